@@ -0,0 +1,138 @@
+'''Streaming per-group summaries of batch predictions.
+
+Targets are grouped by a key (e.g. the gene in a guide name) and only a fixed-size
+summary is kept per group: the number of guides and failed sequences, running
+sums of the frameshift ratios (mean, standard deviation, minimum, maximum) and of
+the outcome distributions (mean distribution), and the best guides by frameshift
+ratio in a heap bounded to best_k entries. Memory use grows with the number of
+groups, not with the number of targets.
+'''
+import heapq
+
+import numpy as np
+
+GROUP_BY = ('name', 'prefix', 'column')
+
+
+def group_key(name: str, group_by: str = 'prefix', separator: str = '_', column: str = None) -> str:
+    '''Group of a target: its whole name, the part of the name before the first separator,
+       or the value of an extra input column'''
+    if group_by == 'column':
+        return column or ''
+    if group_by == 'prefix':
+        return name.split(separator, 1)[0]
+    return name
+
+
+class GroupAggregator:
+    """
+    Running per-group summaries of predictions. add() takes one chunk of predictions
+    at a time; summaries() returns the groups in order of first appearance.
+    """
+
+    def __init__(self, n_class: int, best_k: int = 5):
+        self.n_class = n_class
+        self.best_k = best_k
+        self._index = {}
+        self.keys = []
+        self.count = np.zeros(0, dtype=np.int64)
+        self.errors = np.zeros(0, dtype=np.int64)
+        self.fs_sum = np.zeros(0)
+        self.fs_sq = np.zeros(0)
+        self.fs_min = np.zeros(0)
+        self.fs_max = np.zeros(0)
+        self.y_sum = np.zeros((0, n_class))
+        self.best = []
+        self._seen = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _ids(self, keys) -> np.ndarray:
+        '''Group numbers of keys, adding new groups (the arrays grow geometrically)'''
+        ids = np.empty(len(keys), dtype=np.intp)
+        for k, key in enumerate(keys):
+            g = self._index.get(key)
+            if g is None:
+                g = self._index[key] = len(self.keys)
+                self.keys.append(key)
+                self.best.append([])
+            ids[k] = g
+        if len(self.keys) > len(self.count):
+            size = max(len(self.keys), 2 * len(self.count), 64)
+            for name, fill in (('count', 0), ('errors', 0), ('fs_sum', 0), ('fs_sq', 0),
+                               ('fs_min', np.inf), ('fs_max', -np.inf), ('y_sum', 0)):
+                old = getattr(self, name)
+                new = np.full((size,) + old.shape[1:], fill, dtype=old.dtype)
+                new[:len(old)] = old
+                setattr(self, name, new)
+        return ids
+
+    def add(self, keys, names, sequences, frameshift, y_hat=None):
+        '''Add the predictions of a chunk of valid targets: their group keys, names, sequences,
+           frameshift ratios and, optionally, (N x n_class) outcome distributions'''
+        if not len(keys):
+            return
+        ids = self._ids(keys)
+        fs = np.asarray(frameshift, dtype=np.float64)
+        size = len(self.count)
+        self.count += np.bincount(ids, minlength=size)
+        self.fs_sum += np.bincount(ids, weights=fs, minlength=size)
+        self.fs_sq += np.bincount(ids, weights=fs * fs, minlength=size)
+        np.minimum.at(self.fs_min, ids, fs)
+        np.maximum.at(self.fs_max, ids, fs)
+
+        # rows sorted by group, then by decreasing frameshift ratio (input order for ties)
+        order = np.lexsort((np.arange(len(ids)), -fs, ids))
+        sorted_ids = ids[order]
+        starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+        if y_hat is not None:
+            self.y_sum[sorted_ids[starts]] += np.add.reduceat(np.asarray(y_hat, dtype=np.float64)[order], starts)
+
+        # only the chunk's best_k of each group can enter the group's heap
+        rank = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+        for k in order[rank < self.best_k]:
+            heap = self.best[ids[k]]
+            item = (fs[k], -(self._seen + k), names[k], sequences[k])
+            if len(heap) < self.best_k:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+        self._seen += len(ids)
+
+    def add_errors(self, keys):
+        '''Count failed targets of the given group keys'''
+        if len(keys):
+            ids = self._ids(keys)
+            self.errors += np.bincount(ids, minlength=len(self.errors))
+
+    def summaries(self):
+        '''Per-group dicts: 'group', 'guides', 'errors', 'mean_frameshift', 'sd_frameshift',
+           'min_frameshift', 'max_frameshift', 'best' ([(name, sequence, frameshift)], best
+           first) and 'mean_y_hat' (None for groups without valid targets)'''
+        for g, key in enumerate(self.keys):
+            n = int(self.count[g])
+            mean = self.fs_sum[g] / n if n else float('nan')
+            var = max(self.fs_sq[g] / n - mean * mean, 0.0) * n / (n - 1) if n > 1 else float('nan')
+            yield {'group': key, 'guides': n, 'errors': int(self.errors[g]), 'mean_frameshift': mean,
+                   'sd_frameshift': float(np.sqrt(var)), 'min_frameshift': self.fs_min[g] if n else float('nan'),
+                   'max_frameshift': self.fs_max[g] if n else float('nan'),
+                   'best': [(name, seq, fs) for fs, _, name, seq in sorted(self.best[g], reverse=True)],
+                   'mean_y_hat': self.y_sum[g] / n if n else None}
+
+
+GROUP_COLUMNS = ['Group', 'Guides', 'Errors', 'Mean_Frameshift', 'SD_Frameshift', 'Min_Frameshift',
+                 'Max_Frameshift', 'Best_Guides', 'Top_Mean_Outcomes']
+
+
+def group_row(summary: dict, labels, top_n: int = 5) -> list:
+    '''Row of GROUP_COLUMNS: best guides as name:sequence:frameshift and the top outcomes of
+       the mean distribution as label:frequency%, separated by ';' '''
+    top = ''
+    if summary['mean_y_hat'] is not None:
+        y = summary['mean_y_hat']
+        top = ';'.join(f"{labels[i]}:{y[i] * 100:.2f}%" for i in np.argsort(-y, kind='stable')[:top_n])
+    na = lambda x: 'NA' if np.isnan(x) else f"{x:.4f}"
+    return [summary['group'], summary['guides'], summary['errors'], na(summary['mean_frameshift']),
+            na(summary['sd_frameshift']), na(summary['min_frameshift']), na(summary['max_frameshift']),
+            ';'.join(f"{name}:{seq}:{fs:.4f}" for name, seq, fs in summary['best']), top]
@@ -0,0 +1,180 @@
+'''Content-addressed cache of Lindel predictions.
+
+Predictions are keyed on the 60bp target sequence and a fingerprint of the model,
+and store the full merged class distribution (y_hat) with its frameshift ratio, so
+any number of top outcomes or output format can be served from the cache. Entries
+live in a bounded in-memory LRU and, optionally, in a persistent SQLite database.
+The database is opened in WAL mode with a busy timeout, so several worker
+processes can share it; a database error is reported as a warning and the lookup
+counted as a miss (or the write skipped), never failing the prediction.
+'''
+import collections
+import hashlib
+import sqlite3
+import threading
+import warnings
+
+import numpy as np
+
+from .Predictor import gen_prediction_batch
+from .Profile import profile_stage, profile_count
+
+_VERSION_CACHE = {}
+
+# Seconds a connection waits for another process's write lock on the database
+DB_TIMEOUT = 30.0
+
+
+def model_version(wb, prereq) -> str:
+    '''Fingerprint of a model: a digest of its weights, class labels and frame_shift vector'''
+    key = (id(wb), id(prereq))
+    hit = _VERSION_CACHE.get(key)
+    if hit is not None and hit[0] is wb and hit[1] is prereq:
+        return hit[2]
+    h = hashlib.sha1()
+    for w in wb:
+        h.update(np.ascontiguousarray(w, dtype=np.float64).tobytes())
+    label, rev_index, features, frame_shift = prereq
+    h.update('\t'.join(rev_index[i] for i in range(len(rev_index))).encode())
+    h.update(np.ascontiguousarray(frame_shift, dtype=np.float64).tobytes())
+    version = h.hexdigest()[:16]
+    _VERSION_CACHE[key] = (wb, prereq, version)
+    return version
+
+
+class PredictionCache:
+    """
+    Bounded LRU cache of (y_hat, frameshift) predictions keyed by target sequence,
+    optionally backed by a SQLite database at path that persists across runs.
+
+    Keys include the model version, so one database can hold predictions of several
+    models. All methods are thread-safe. Hit and miss counts are available from stats().
+    """
+
+    def __init__(self, max_size: int = 10000, path: str = None, version: str = ''):
+        self.max_size = max_size
+        self.path = path
+        self.version = version
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            try:
+                self._db = sqlite3.connect(path, timeout=DB_TIMEOUT, check_same_thread=False)
+                self._db.execute('PRAGMA journal_mode=WAL')
+                self._db.execute('CREATE TABLE IF NOT EXISTS predictions '
+                                 '(version TEXT, sequence TEXT, y_hat BLOB, frameshift REAL, '
+                                 'PRIMARY KEY (version, sequence)) WITHOUT ROWID')
+                self._db.commit()
+            except sqlite3.Error as e:
+                _warn(f"cannot open prediction cache database {path}: {e}; caching in memory only")
+                self.close()
+
+    def get_many(self, seqs: list) -> list:
+        '''Look up sequences; returns a list with (y_hat, frameshift) or None per sequence'''
+        found = [None] * len(seqs)
+        missing = {}
+        with self._lock:
+            for i, seq in enumerate(seqs):
+                entry = self._entries.get(seq)
+                if entry is not None:
+                    self._entries.move_to_end(seq)
+                    found[i] = entry
+                    self.hits += 1
+                else:
+                    missing.setdefault(seq, []).append(i)
+            if self._db is not None and missing:
+                try:
+                    for seq, entry in self._load(list(missing)):
+                        self._remember(seq, entry)
+                        for i in missing.pop(seq):
+                            found[i] = entry
+                            self.hits += 1
+                            self.disk_hits += 1
+                except sqlite3.Error as e:
+                    _warn(f"prediction cache lookup failed, predicting instead: {e}")
+            self.misses += sum(len(idx) for idx in missing.values())
+        return found
+
+    def put_many(self, seqs: list, y_hat: np.ndarray, fs: np.ndarray):
+        '''Store the predictions of a batch of sequences'''
+        with self._lock:
+            for k, seq in enumerate(seqs):
+                self._remember(seq, (y_hat[k].copy(), float(fs[k])))
+            if self._db is not None:
+                try:
+                    with self._db:
+                        self._db.executemany('INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?)',
+                                             [(self.version, seq, np.asarray(y_hat[k], dtype=np.float64).tobytes(),
+                                               float(fs[k])) for k, seq in enumerate(seqs)])
+                except sqlite3.Error as e:
+                    _warn(f"prediction cache write skipped: {e}")
+
+    def get(self, seq: str):
+        return self.get_many([seq])[0]
+
+    def put(self, seq: str, y_hat: np.ndarray, fs: float):
+        self.put_many([seq], y_hat[None, :], np.array([fs]))
+
+    def stats(self) -> dict:
+        '''Hit/miss counters and the number of sequences held in memory'''
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else 0.0, 'size': len(self._entries)}
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _remember(self, seq, entry):
+        if self.max_size <= 0:
+            return
+        self._entries[seq] = entry
+        self._entries.move_to_end(seq)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _load(self, seqs):
+        for start in range(0, len(seqs), 500):
+            chunk = seqs[start:start + 500]
+            rows = self._db.execute('SELECT sequence, y_hat, frameshift FROM predictions WHERE version = ? '
+                                    'AND sequence IN (%s)' % ','.join('?' * len(chunk)), [self.version] + chunk)
+            for seq, blob, fs in rows:
+                yield seq, (np.frombuffer(blob, dtype=np.float64), fs)
+
+
+def _warn(message: str):
+    warnings.warn(message, RuntimeWarning, stacklevel=3)
+
+
+def gen_prediction_cached(seqs, wb, prereq, cache: PredictionCache):
+    '''gen_prediction_batch through a PredictionCache: only sequences missing from the
+       cache are predicted, and their predictions are stored in it'''
+    seqs = [str(seq) for seq in seqs]
+    with profile_stage('cache', len(seqs)):
+        found = cache.get_many(seqs)
+    n_class = len(prereq[3])
+    y_hat = np.zeros((len(seqs), n_class))
+    fs = np.zeros(len(seqs))
+    todo = {}
+    for i, entry in enumerate(found):
+        if entry is None:
+            todo.setdefault(seqs[i], []).append(i)
+        else:
+            y_hat[i], fs[i] = entry
+    profile_count('cache_hits', len(seqs) - sum(len(idx) for idx in todo.values()))
+    profile_count('cache_misses', sum(len(idx) for idx in todo.values()))
+    if todo:
+        new_seqs = list(todo)
+        new_y, new_fs = gen_prediction_batch(new_seqs, wb, prereq)
+        with profile_stage('cache', len(new_seqs)):
+            cache.put_many(new_seqs, new_y, new_fs)
+        for k, seq in enumerate(new_seqs):
+            y_hat[todo[seq]] = new_y[k]
+            fs[todo[seq]] = new_fs[k]
+    return (y_hat, fs)
@@ -0,0 +1,254 @@
+'''Column-wise binary storage of batch predictions.
+
+Instead of one text row per (sequence, outcome), predictions are stored as
+columns: per-sequence values (name, sequence, frameshift ratio, error message)
+and the (N x 557) float32 class probability matrix, dense or, with a probability
+threshold, as CSR arrays. Writers accept one chunk at a time and spool it to disk,
+so memory use does not grow with the number of sequences.
+
+NPZ output is an uncompressed zip of .npy members, whose arrays can be
+memory-mapped in place with open_npz. Parquet output needs pyarrow.
+'''
+import io
+import json
+import os
+import shutil
+import struct
+import tempfile
+import time
+import zipfile
+
+import numpy as np
+
+STRING_COLUMNS = ('name', 'sequence', 'error')
+
+# Array data in written NPZ files starts at a multiple of ALIGNMENT bytes, padded with a
+# zip extra field of this id (the one used by Android's zipalign)
+ALIGNMENT = 64
+ALIGNMENT_EXTRA_ID = 0xD935
+
+
+class NpzPredictionWriter:
+    """
+    Incrementally write predictions into an NPZ file.
+
+    Members: one array per column passed to write(), 'labels' (class labels) and either
+    'y_hat' (dense N x n_class float32) or 'y_data', 'y_indices', 'y_indptr' and 'y_shape'
+    (CSR layout keeping probabilities >= sparse_threshold).
+    """
+
+    def __init__(self, path: str, labels: list = None, sparse_threshold: float = None):
+        self.path = path
+        self.labels = labels
+        self.sparse_threshold = sparse_threshold
+        self.n_rows = 0
+        self.n_class = len(labels) if labels is not None else None
+        self._tmpdir = tempfile.mkdtemp(prefix='lindel_npz_', dir=os.path.dirname(os.path.abspath(path)))
+        self._spools = {}
+        self._dtypes = {}
+        self._widths = {}
+        self._nnz = 0
+        self._indptr = self._spool('y_indptr', np.int64)
+        if sparse_threshold is not None:
+            self._indptr.write(np.zeros(1, dtype=np.int64).tobytes())
+
+    def write(self, columns: dict, y_hat: np.ndarray = None):
+        '''Append a chunk: per-row columns (strings or numbers) and optionally its class probabilities'''
+        n = None
+        for name, values in columns.items():
+            n = len(values)
+            if name in STRING_COLUMNS or (len(values) and isinstance(values[0], str)):
+                f = self._spool(name, str)
+                values = ['' if v is None else str(v) for v in values]
+                self._widths[name] = max([self._widths.get(name, 1)] + [len(v) for v in values])
+                f.write(''.join(v.replace('\n', ' ') + '\n' for v in values).encode('utf-8'))
+            else:
+                values = np.asarray(values)
+                self._dtypes.setdefault(name, values.dtype)
+                self._spool(name, values.dtype).write(values.astype(self._dtypes[name]).tobytes())
+        if y_hat is not None:
+            y_hat = np.asarray(y_hat, dtype=np.float32)
+            n = len(y_hat)
+            self.n_class = y_hat.shape[1]
+            if self.sparse_threshold is None:
+                self._spool('y_hat', np.float32).write(y_hat.tobytes())
+            else:
+                rows, cols = np.nonzero(y_hat >= self.sparse_threshold)
+                self._spool('y_data', np.float32).write(y_hat[rows, cols].tobytes())
+                self._spool('y_indices', np.int32).write(cols.astype(np.int32).tobytes())
+                indptr = self._nnz + np.cumsum(np.bincount(rows, minlength=len(y_hat)))
+                self._indptr.write(indptr.astype(np.int64).tobytes())
+                self._nnz += len(rows)
+        if n is not None:
+            self.n_rows += n
+
+    def close(self):
+        try:
+            with open(self.path, 'wb') as raw, zipfile.ZipFile(raw, 'w', zipfile.ZIP_STORED, allowZip64=True) as zf:
+                for name, f in self._spools.items():
+                    f.flush()
+                    f.seek(0)
+                    if name == 'y_indptr' and self.sparse_threshold is None:
+                        continue
+                    if name in self._widths:
+                        self._zip_strings(zf, raw, name, f, self._widths[name])
+                        continue
+                    dtype = {'y_hat': np.float32, 'y_data': np.float32, 'y_indices': np.int32,
+                             'y_indptr': np.int64}.get(name, self._dtypes.get(name))
+                    dtype = np.dtype(dtype)
+                    count = os.fstat(f.fileno()).st_size // dtype.itemsize
+                    shape = (self.n_rows, self.n_class) if name == 'y_hat' else (count,)
+                    with _open_member(zf, raw, name, dtype, shape) as out:
+                        shutil.copyfileobj(f, out, 1 << 20)
+                if self.sparse_threshold is not None:
+                    _zip_array(zf, raw, 'y_shape', np.array([self.n_rows, self.n_class or 0], dtype=np.int64))
+                if self.labels is not None:
+                    _zip_array(zf, raw, 'labels', np.array(self.labels))
+        finally:
+            for f in self._spools.values():
+                f.close()
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
+
+    def _spool(self, name, dtype):
+        if name not in self._spools:
+            self._spools[name] = open(os.path.join(self._tmpdir, name), 'w+b')
+        return self._spools[name]
+
+    def _zip_strings(self, zf, raw, name, f, width):
+        dtype = np.dtype(f'<U{width}')
+        with _open_member(zf, raw, name, dtype, (self.n_rows,)) as out:
+            block = []
+            for line in f:
+                block.append(line[:-1].decode('utf-8'))
+                if len(block) == 65536:
+                    out.write(np.array(block, dtype=dtype).tobytes())
+                    block = []
+            if block:
+                out.write(np.array(block, dtype=dtype).tobytes())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _member_info(filename: str, pad: int) -> zipfile.ZipInfo:
+    info = zipfile.ZipInfo(filename, time.localtime()[:6])
+    info.extra = struct.pack('<HH', ALIGNMENT_EXTRA_ID, pad) + bytes(pad)
+    return info
+
+
+def _local_header_size(filename: str) -> int:
+    '''Size of the local header zipfile writes for a zip64 member with an empty padding
+       field, measured on a scratch archive rather than derived from zipfile internals'''
+    scratch = io.BytesIO()
+    with zipfile.ZipFile(scratch, 'w', zipfile.ZIP_STORED, allowZip64=True) as probe:
+        with probe.open(_member_info(filename, 0), 'w', force_zip64=True):
+            return scratch.tell()
+
+
+def _open_member(zf, raw, name, dtype, shape):
+    '''Open an .npy member of zf, which writes to the file object raw, with its header
+       written. The local header is padded (extra field ALIGNMENT_EXTRA_ID) so that the
+       array data starts at a multiple of ALIGNMENT bytes in the file and memory-maps
+       aligned.'''
+    header = io.BytesIO()
+    np.lib.format.write_array_header_2_0(header, {'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)),
+                                                  'fortran_order': False, 'shape': tuple(shape)})
+    header = header.getvalue()
+    filename = name + '.npy'
+    pad = -(raw.tell() + _local_header_size(filename) + len(header)) % ALIGNMENT
+    out = zf.open(_member_info(filename, pad), 'w', force_zip64=True)
+    offset = raw.tell() + len(header)
+    if offset % ALIGNMENT:
+        out.close()
+        raise RuntimeError(f"{filename}: array data at offset {offset} is not {ALIGNMENT}-byte aligned")
+    out.write(header)
+    return out
+
+
+def _zip_array(zf, raw, name, array):
+    array = np.ascontiguousarray(array)
+    with _open_member(zf, raw, name, array.dtype, array.shape) as out:
+        out.write(array.tobytes())
+
+
+def open_npz(path: str) -> dict:
+    '''Open an NPZ written by NpzPredictionWriter (or any uncompressed NPZ), memory-mapping
+       every member read-only instead of loading it'''
+    arrays = {}
+    with zipfile.ZipFile(path) as zf, open(path, 'rb') as raw:
+        for info in zf.infolist():
+            if info.compress_type != zipfile.ZIP_STORED or not info.filename.endswith('.npy'):
+                raise ValueError(f"{path}: member {info.filename} cannot be memory-mapped")
+            raw.seek(info.header_offset)
+            local = raw.read(30)
+            name_len, extra_len = struct.unpack('<HH', local[26:30])
+            raw.seek(info.header_offset + 30 + name_len + extra_len)
+            if np.lib.format.read_magic(raw) == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(raw)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(raw)
+            if not np.prod(shape):
+                arrays[info.filename[:-4]] = np.zeros(shape, dtype=dtype)
+                continue
+            arrays[info.filename[:-4]] = np.memmap(path, dtype=dtype, mode='r', offset=raw.tell(),
+                                                   shape=shape, order='F' if fortran else 'C')
+    return arrays
+
+
+class ParquetPredictionWriter:
+    """
+    Incrementally write predictions into a Parquet file (requires pyarrow), one row
+    group per chunk. Class probabilities are stored as a fixed-size list<float32>
+    column 'y_hat', or with sparse_threshold as list columns 'class_index' and
+    'probability'. The class labels are kept in the schema metadata.
+    """
+
+    def __init__(self, path: str, labels: list = None, sparse_threshold: float = None):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Parquet output requires pyarrow (pip install pyarrow)")
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.path = path
+        self.labels = labels
+        self.sparse_threshold = sparse_threshold
+        self._writer = None
+
+    def write(self, columns: dict, y_hat: np.ndarray = None):
+        pa = self.pa
+        data = {}
+        for name, values in columns.items():
+            if name in STRING_COLUMNS or (len(values) and isinstance(values[0], str)):
+                data[name] = pa.array([None if v is None else str(v) for v in values], type=pa.string())
+            else:
+                data[name] = pa.array(np.asarray(values))
+        if y_hat is not None:
+            y_hat = np.asarray(y_hat, dtype=np.float32)
+            if self.sparse_threshold is None:
+                data['y_hat'] = pa.FixedSizeListArray.from_arrays(pa.array(y_hat.ravel()), y_hat.shape[1])
+            else:
+                rows, cols = np.nonzero(y_hat >= self.sparse_threshold)
+                offsets = pa.array(np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=len(y_hat))))).astype(np.int32))
+                data['class_index'] = pa.ListArray.from_arrays(offsets, pa.array(cols.astype(np.int16)))
+                data['probability'] = pa.ListArray.from_arrays(offsets, pa.array(y_hat[rows, cols]))
+        table = pa.table(data)
+        if self._writer is None:
+            metadata = {b'lindel_labels': json.dumps(self.labels).encode()} if self.labels is not None else None
+            self._writer = self.pq.ParquetWriter(self.path, table.schema.with_metadata(metadata))
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is None:
+            self.write({name: [] for name in STRING_COLUMNS[:2]})
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
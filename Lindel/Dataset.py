@@ -0,0 +1,212 @@
+'''Streaming construction of training matrices from observed editing outcomes.
+
+create_label_array and create_feature_array build one dense row per target from
+nested dicts. build_training_set instead reads outcome counts from a text file,
+one "target<TAB>outcome<TAB>count" row per observed outcome, grouped by target.
+It computes the inputs of the three model heads (as in Predictor.sparse_inputs_batch)
+and the outcome frequencies for a chunk of targets at a time, and writes each chunk
+as CSR arrays in an uncompressed NPZ file. Memory use is bounded by the chunk size,
+so the set can hold millions of targets.
+
+Outcomes use the class labels of the model prerequisites, e.g. '-3+2' for a 3bp
+deletion or '1+A' for a 1bp insertion of A. Counts for outcomes that are not a
+model class are reported as 'unlabelled' and left out of the frequencies.
+
+A training set is a directory of chunk_NNNNN.npz files and a manifest.json, read
+back with TrainingSet.
+'''
+import io
+import json
+import os
+
+import numpy as np
+
+from .Predictor import (_sparse, validate_sequence, encode_sequences, indel_template, _collapse_deletions,
+                        sparse_inputs_batch, open_input)
+
+MANIFEST = 'manifest.json'
+MATRICES = ('x_indel', 'x_del', 'x_ins', 'y')
+
+
+def open_counts(path: str) -> io.TextIOBase:
+    '''Open an outcome count file for streaming ('-' for standard input, gzip detected)'''
+    return open_input(path)
+
+
+def read_outcome_counts(lines):
+    '''Group "target<TAB>outcome<TAB>count" lines into (target, {outcome: count}) per target.
+       Rows of a target must be consecutive (a ValueError is raised for a target seen again
+       later); blank lines, '#' comments and a header line (non-numeric count) are skipped,
+       and repeated outcomes of a target are summed.'''
+    target, counts, done = None, {}, set()
+    for i, line in enumerate(lines):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        parts = line.split('\t')
+        if len(parts) != 3:
+            raise ValueError(f"Line {i + 1}: expected target, outcome and count, got {len(parts)} fields")
+        try:
+            count = float(parts[2])
+        except ValueError:
+            if i == 0:
+                continue
+            raise ValueError(f"Line {i + 1}: invalid count {parts[2]!r}")
+        seq = parts[0].strip().upper()
+        if seq != target:
+            if seq in done:
+                raise ValueError(f"Line {i + 1}: rows of target {seq} are not consecutive")
+            if target is not None:
+                done.add(target)
+                yield target, counts
+            target, counts = seq, {}
+        counts[parts[1]] = counts.get(parts[1], 0.0) + count
+    if target is not None:
+        yield target, counts
+
+
+def label_matrix(counts: list, label: dict, dtype=np.float32):
+    '''CSR matrix of outcome frequencies (one row per {outcome: count} dict, one column per class),
+       with each row's total labelled count and the count of outcomes that are not a class'''
+    rows, cols, values = [], [], []
+    unlabelled = np.zeros(len(counts))
+    for i, c in enumerate(counts):
+        for outcome, n in c.items():
+            col = label.get(outcome)
+            if col is None:
+                unlabelled[i] += n
+            elif n:
+                rows.append(i)
+                cols.append(col)
+                values.append(n)
+    y = _sparse().csr_matrix((np.array(values, dtype=np.float64), (rows, cols)), shape=(len(counts), len(label)))
+    total = np.asarray(y.sum(axis=1)).ravel()
+    y = _sparse().diags(np.divide(1.0, total, out=np.zeros_like(total), where=total > 0)) @ y
+    return y.tocsr().astype(dtype), total, unlabelled
+
+
+def build_training_set(counts_file: str, output_dir: str, prereq, chunk_size: int = 10000,
+                       dtype=np.float32, min_count: float = 0) -> dict:
+    '''Write the head inputs and outcome frequencies of every valid target in counts_file
+       (see read_outcome_counts) to output_dir, chunk_size targets per chunk file. Targets
+       failing validate_sequence or with a labelled count below min_count (or zero) are
+       skipped. Returns the manifest.'''
+    label, rev_index, features, frame_shift = prereq
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = {'rows': 0, 'skipped': 0, 'unlabelled': 0.0, 'dtype': np.dtype(dtype).name,
+                'shapes': {'x_indel': 4 * 20 + 16 * 19, 'x_del': len(features) + 4 * 20 + 16 * 19,
+                           'x_ins': 4 * 6 + 16 * 5, 'y': len(label)},
+                'classes': [rev_index[i] for i in range(len(label))], 'chunks': []}
+    with open_counts(counts_file) as f:
+        batch = []
+        for target, counts in read_outcome_counts(f):
+            is_valid, seq = validate_sequence(target)
+            if not is_valid:
+                manifest['skipped'] += 1
+                continue
+            batch.append((seq, counts))
+            if len(batch) == chunk_size:
+                _write_chunk(output_dir, batch, label, features, dtype, min_count, manifest)
+                batch = []
+        if batch:
+            _write_chunk(output_dir, batch, label, features, dtype, min_count, manifest)
+    tmp = os.path.join(output_dir, MANIFEST + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, os.path.join(output_dir, MANIFEST))
+    return manifest
+
+
+def _write_chunk(output_dir, batch, label, features, dtype, min_count, manifest):
+    y, total, unlabelled = label_matrix([c for _, c in batch], label, dtype)
+    manifest['unlabelled'] += float(unlabelled.sum())
+    use = (total > 0) & (total >= min_count)
+    manifest['skipped'] += int((~use).sum())
+    if not use.any():
+        return
+    seqs = [s for (s, _), u in zip(batch, use) if u]
+    codes = encode_sequences(seqs)
+    keep, mh, _ = _collapse_deletions(codes, indel_template())
+    matrices = dict(zip(MATRICES, sparse_inputs_batch(codes, features, keep, mh, dtype) + (y[use],)))
+    arrays = {'sequence': np.array(seqs), 'total': total[use], 'unlabelled': unlabelled[use]}
+    for name, m in matrices.items():
+        arrays.update({f'{name}_data': m.data, f'{name}_indices': m.indices, f'{name}_indptr': m.indptr})
+    name = f"chunk_{len(manifest['chunks']):05d}.npz"
+    tmp = os.path.join(output_dir, name + '.tmp')
+    with open(tmp, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp, os.path.join(output_dir, name))
+    manifest['chunks'].append({'file': name, 'rows': len(seqs)})
+    manifest['rows'] += len(seqs)
+
+
+class TrainingSet:
+    """
+    Read a training set written by build_training_set, one chunk at a time. Chunk
+    arrays are memory-mapped, so only the chunks being used are read from disk.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        self.classes = self.manifest['classes']
+
+    def __len__(self):
+        return self.manifest['rows']
+
+    def chunks(self, matrices=MATRICES):
+        '''Yield each chunk as a dict of 'sequence', 'total', 'unlabelled' and the requested
+           CSR matrices: 'x_indel', 'x_del', 'x_ins' (head inputs) and 'y' (outcome frequencies)'''
+        from .Columnar import open_npz
+        for chunk in self.manifest['chunks']:
+            arrays = open_npz(os.path.join(self.path, chunk['file']))
+            out = {'sequence': arrays['sequence'], 'total': arrays['total'], 'unlabelled': arrays['unlabelled']}
+            for name in matrices:
+                shape = (chunk['rows'], self.manifest['shapes'][name])
+                out[name] = _sparse().csr_matrix(
+                    (arrays[f'{name}_data'], arrays[f'{name}_indices'], arrays[f'{name}_indptr']), shape=shape)
+            yield out
+
+    def __iter__(self):
+        return self.chunks()
+
+    def load(self, matrices=MATRICES) -> dict:
+        '''The whole set in memory, with each requested matrix stacked over the chunks'''
+        parts = list(self.chunks(matrices))
+        out = {key: np.concatenate([p[key] for p in parts]) if parts else np.zeros(0)
+               for key in ('sequence', 'total', 'unlabelled')}
+        for name in matrices:
+            out[name] = (_sparse().vstack([p[name] for p in parts], format='csr') if parts else
+                         _sparse().csr_matrix((0, self.manifest['shapes'][name])))
+        return out
+
+
+def main():
+    import argparse
+    from .Model import load_model
+    parser = argparse.ArgumentParser(description='Build chunked sparse training matrices from observed outcome counts')
+    parser.add_argument('counts', type=str,
+                        help="Tab-separated target, outcome and count rows, grouped by target ('-' for stdin, may be gzipped)")
+    parser.add_argument('output', type=str, help='Output directory')
+    parser.add_argument('--chunk-size', type=int, default=10000, help='Targets per chunk file (default: 10000)')
+    parser.add_argument('--min-count', type=float, default=0, help='Skip targets with fewer labelled reads')
+    parser.add_argument('--dtype', choices=['float32', 'float64'], default='float32',
+                        help='Value type of the stored matrices (default: float32)')
+    args = parser.parse_args()
+    if args.chunk_size < 1:
+        parser.error("--chunk-size must be at least 1")
+    _, prereq = load_model()
+    try:
+        manifest = build_training_set(args.counts, args.output, prereq, args.chunk_size, args.dtype, args.min_count)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        raise SystemExit(1)
+    print(f"Targets written: {manifest['rows']} in {len(manifest['chunks'])} chunks to {args.output}")
+    print(f"Targets skipped: {manifest['skipped']}")
+    if manifest['unlabelled']:
+        print(f"Counts of outcomes outside the model classes (ignored): {manifest['unlabelled']:g}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+'''A thread-safe predictor object for using Lindel inside Python applications.
+
+LindelPredictor loads the model once, makes the weight arrays read-only and
+builds the lookup tables of Lindel.Predictor up front, so that the prediction
+functions only read shared state afterwards. predict_many validates sequences in
+the calling thread and scores them in chunks on a thread pool. NumPy releases
+the GIL inside the matrix products and most of the array operations of a chunk,
+so chunks run in parallel on several cores. predict_many_async runs the same
+chunks from an asyncio event loop without blocking it.
+
+Thread safety: any number of threads may call one LindelPredictor concurrently.
+The only shared mutable state is the optional profiler (Lindel.Profile), whose
+counters may miss updates under concurrency.
+'''
+import asyncio
+import concurrent.futures
+import os
+import threading
+
+import numpy as np
+
+from .Model import load_model
+from .Predictor import validate_sequence, gen_prediction_batch, top_k_classes, class_table
+
+# Any valid target, predicted once at start-up to build the lookup tables
+_WARMUP = 'GCACGCTCGTTCAGGTCCACGTTAGTCCTGGGGCGGAGTAGTTTAGTCACAATGTTTCCG'
+
+
+def _class_lists(classes):
+    '''Labels, outcome types and sizes of the classes as Python lists, for building results'''
+    return (list(classes.labels), ['insertion' if ins else 'deletion' for ins in classes.is_insertion],
+            classes.size.tolist())
+
+
+def _result(class_lists, sequence: str, top_idx, top_freq, fs: float) -> dict:
+    labels, types, sizes = class_lists
+    predictions = [{'label': labels[c], 'frequency': round(p * 100, 4), 'type': types[c], 'size': sizes[c]}
+                   for c, p in zip(top_idx, top_freq) if c >= 0]
+    return {'sequence': sequence, 'frameshift_ratio': round(float(fs), 4),
+            'num_predictions': len(predictions), 'predictions': predictions}
+
+
+def build_result(classes, sequence: str, y_hat, fs: float, top_n: int) -> dict:
+    '''Result of one sequence: its frameshift ratio and top_n outcomes as {'label',
+       'frequency' (percent), 'type', 'size'}'''
+    top_idx, top_freq = top_k_classes(y_hat, top_n)
+    return _result(_class_lists(classes), sequence, top_idx[0].tolist(), top_freq[0].tolist(), fs)
+
+
+def _read_only(array):
+    view = np.asarray(array).view()
+    view.flags.writeable = False
+    return view
+
+
+class LindelPredictor:
+    """
+    Predict indel outcomes from Python, from any number of threads.
+
+    threads is the size of the thread pool of predict_many (default: the number
+    of CPUs) and chunk_size the number of sequences per pooled task. Invalid
+    sequences give {'error', 'sequence'} results with the messages of
+    Lindel_prediction.py. Use as a context manager, or call close(), to shut the
+    pool down.
+    """
+
+    def __init__(self, model_dir: str = None, dtype=np.float64, threads: int = None, chunk_size: int = 256,
+                 top_n: int = 20, wb=None, prereq=None):
+        if wb is None or prereq is None:
+            wb, prereq = load_model(model_dir, dtype=dtype)
+        self.wb = tuple(_read_only(w) for w in wb)
+        self.prereq = prereq
+        self.classes = class_table(prereq[1])
+        self._class_lists = _class_lists(self.classes)
+        self.threads = max(1, threads or os.cpu_count() or 1)
+        self.chunk_size = max(1, chunk_size)
+        self.top_n = top_n
+        self._pool = None
+        self._lock = threading.Lock()
+        gen_prediction_batch([_WARMUP], self.wb, self.prereq)
+
+    def _executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = concurrent.futures.ThreadPoolExecutor(self.threads, thread_name_prefix='lindel')
+            return self._pool
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _validate(self, sequences):
+        results, valid_idx, valid_seqs = [None] * len(sequences), [], []
+        for i, sequence in enumerate(sequences):
+            if not isinstance(sequence, str):
+                results[i] = {'error': 'Sequence must be a string', 'sequence': sequence}
+                continue
+            is_valid, result = validate_sequence(sequence)
+            if is_valid:
+                valid_idx.append(i)
+                valid_seqs.append(result)
+            else:
+                results[i] = {'error': result, 'sequence': sequence}
+        return results, valid_idx, valid_seqs
+
+    def _chunks(self, seqs):
+        # no more chunks than needed to give every thread some work
+        size = min(self.chunk_size, -(-len(seqs) // self.threads)) if seqs else 1
+        return [seqs[start:start + size] for start in range(0, len(seqs), size)]
+
+    def _predict_chunk(self, seqs):
+        return gen_prediction_batch(seqs, self.wb, self.prereq)
+
+    def _collect(self, results, valid_idx, valid_seqs, parts, top_n):
+        top_n = self.top_n if top_n is None else top_n
+        k = 0
+        for y_hat, fs in parts:
+            top_idx, top_freq = top_k_classes(y_hat, top_n)
+            for idx, freq, f in zip(top_idx.tolist(), top_freq.tolist(), fs.tolist()):
+                results[valid_idx[k]] = _result(self._class_lists, valid_seqs[k], idx, freq, f)
+                k += 1
+        return results
+
+    def _run(self, chunks, parallel: bool = True):
+        if not parallel or self.threads == 1 or len(chunks) <= 1:
+            return [self._predict_chunk(chunk) for chunk in chunks]
+        return list(self._executor().map(self._predict_chunk, chunks))
+
+    def predict(self, sequence: str, top_n: int = None) -> dict:
+        '''Predict one sequence in the calling thread'''
+        results, valid_idx, valid_seqs = self._validate([sequence])
+        return self._collect(results, valid_idx, valid_seqs, self._run([valid_seqs] if valid_seqs else [], False),
+                             top_n)[0]
+
+    def predict_many(self, sequences, top_n: int = None, parallel: bool = True) -> list:
+        '''Predict many sequences, in chunks on the thread pool (or, with parallel=False, in
+           the calling thread). Returns one result per sequence, in input order.'''
+        results, valid_idx, valid_seqs = self._validate(list(sequences))
+        return self._collect(results, valid_idx, valid_seqs, self._run(self._chunks(valid_seqs), parallel), top_n)
+
+    async def predict_many_async(self, sequences, top_n: int = None) -> list:
+        '''predict_many for asyncio applications: the chunks run on the thread pool while
+           the event loop keeps serving other tasks'''
+        results, valid_idx, valid_seqs = self._validate(list(sequences))
+        loop = asyncio.get_running_loop()
+        pool = self._executor()
+        parts = await asyncio.gather(*(loop.run_in_executor(pool, self._predict_chunk, chunk)
+                                       for chunk in self._chunks(valid_seqs)))
+        return self._collect(results, valid_idx, valid_seqs, parts, top_n)
+
+    def distributions(self, sequences):
+        '''Full outcome distributions of valid sequences, on the thread pool: returns
+           (y_hat (N x 557, columns as self.classes.labels), frameshift ratios (N,), valid (bool mask
+           over sequences)). Rows of invalid sequences are left out.'''
+        results, valid_idx, valid_seqs = self._validate(list(sequences))
+        valid = np.zeros(len(results), dtype=bool)
+        valid[valid_idx] = True
+        if not valid_seqs:
+            return np.zeros((0, len(self.classes.labels))), np.zeros(0), valid
+        parts = self._run(self._chunks(valid_seqs))
+        return np.vstack([p[0] for p in parts]), np.concatenate([p[1] for p in parts]), valid
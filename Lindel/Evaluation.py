@@ -0,0 +1,140 @@
+'''Comparison of predicted and observed outcome distributions.
+
+Observed outcomes are read as in Lindel.Dataset: a "target<TAB>outcome<TAB>count"
+file (counts or frequencies, normalised per target over the model classes) or a
+training set directory written by build_training_set. evaluate predicts a chunk of
+targets at a time with gen_prediction_batch and scores it on the (N x 557)
+matrices, after combining the microhomology-redundant classes of the observations
+as the predictions combine them: mean squared error and KL divergence of the
+distributions, the predicted and observed frameshift ratios and whether the most
+frequent outcome agrees. EvaluationSummary accumulates the aggregates over chunks,
+including the Pearson correlation of the frameshift ratios.
+'''
+import os
+
+import numpy as np
+
+from .Predictor import (validate_sequence, gen_prediction_batch, encode_sequences, gen_indel_batch,
+                        gen_merge_index_batch, merge_classes)
+from .Dataset import MANIFEST, TrainingSet, open_counts, read_outcome_counts, label_matrix
+
+
+def observed_chunks(path: str, label: dict, chunk_size: int = 1000, min_count: float = 0):
+    '''Yield chunks of observed outcomes as dicts of 'sequence', 'y' (CSR frequencies),
+       'total' (labelled count) and 'skipped' (targets dropped from the input so far)'''
+    if os.path.isfile(os.path.join(path, MANIFEST)):
+        for chunk in TrainingSet(path).chunks(('y',)):
+            use = chunk['total'] >= min_count
+            yield {'sequence': chunk['sequence'][use], 'y': chunk['y'][use], 'total': chunk['total'][use],
+                   'skipped': int((~use).sum())}
+        return
+    with open_counts(path) as f:
+        batch, skipped = [], 0
+        for target, counts in read_outcome_counts(f):
+            is_valid, seq = validate_sequence(target)
+            if not is_valid:
+                skipped += 1
+                continue
+            batch.append((seq, counts))
+            if len(batch) == chunk_size:
+                yield _observed(batch, label, min_count, skipped)
+                batch, skipped = [], 0
+        if batch or skipped:
+            yield _observed(batch, label, min_count, skipped)
+
+
+def _observed(batch, label, min_count, skipped):
+    y, total, _ = label_matrix([c for _, c in batch], label, np.float64)
+    use = (total > 0) & (total >= min_count)
+    return {'sequence': np.array([s for s, _ in batch], dtype='U60')[use], 'y': y[use], 'total': total[use],
+            'skipped': skipped + int((~use).sum())}
+
+
+def merge_observed(y_obs: np.ndarray, sequences, label: dict) -> np.ndarray:
+    '''Observed (N x n_class) distributions with the microhomology-redundant classes of each
+       target combined, as gen_prediction_batch combines them in the predictions (where they
+       are 0)'''
+    if not len(sequences):
+        return y_obs
+    keep, mh = gen_indel_batch(encode_sequences(sequences))
+    return merge_classes(y_obs, gen_merge_index_batch(label, keep, mh))
+
+
+def outcome_metrics(y_pred: np.ndarray, y_obs: np.ndarray, frame_shift: np.ndarray, eps: float = 1e-12) -> dict:
+    '''Per-target metrics of predicted against observed (N x n_class) distributions: 'mse',
+       'kl' (KL divergence of the prediction from the observation, in nats, with predicted
+       probabilities floored at eps), 'frameshift_pred', 'frameshift_obs', 'top_pred',
+       'top_obs' and 'top1' (most frequent outcomes agree)'''
+    y_pred = np.asarray(y_pred, dtype=np.float64)
+    y_obs = np.asarray(y_obs, dtype=np.float64)
+    seen = y_obs > 0
+    ratio = np.divide(y_obs, np.maximum(y_pred, eps), out=np.ones_like(y_obs), where=seen)
+    top_pred, top_obs = y_pred.argmax(axis=1), y_obs.argmax(axis=1)
+    return {'mse': np.mean((y_pred - y_obs) ** 2, axis=1),
+            'kl': np.sum(y_obs * np.log(ratio), axis=1),
+            'frameshift_pred': y_pred @ frame_shift, 'frameshift_obs': y_obs @ frame_shift,
+            'top_pred': top_pred, 'top_obs': top_obs, 'top1': top_pred == top_obs}
+
+
+class EvaluationSummary:
+    """Running aggregates of outcome_metrics over chunks: mean MSE and KL divergence,
+    top-1 agreement and the Pearson correlation of the frameshift ratios (merged from
+    per-chunk means and co-moments, so the result does not depend on the chunking)."""
+
+    def __init__(self):
+        self.n = 0
+        self.skipped = 0
+        self.sums = {'mse': 0.0, 'kl': 0.0, 'top1': 0}
+        self.mean = np.zeros(2)
+        self.comoment = np.zeros((2, 2))
+
+    def update(self, metrics: dict, skipped: int = 0):
+        self.skipped += skipped
+        m = len(metrics['mse'])
+        if not m:
+            return
+        for key in self.sums:
+            self.sums[key] += metrics[key].sum()
+        x = np.vstack((metrics['frameshift_pred'], metrics['frameshift_obs']))
+        mean = x.mean(axis=1)
+        centered = x - mean[:, None]
+        delta = mean - self.mean
+        n = self.n + m
+        self.comoment += centered @ centered.T + np.outer(delta, delta) * self.n * m / n
+        self.mean += delta * m / n
+        self.n = n
+
+    def result(self) -> dict:
+        n = max(self.n, 1)
+        var = np.diag(self.comoment)
+        pearson = self.comoment[0, 1] / np.sqrt(var[0] * var[1]) if (var > 0).all() else float('nan')
+        return {'targets': self.n, 'skipped': self.skipped, 'mean_mse': float(self.sums['mse'] / n),
+                'mean_kl': float(self.sums['kl'] / n), 'frameshift_pearson': float(pearson),
+                'top1_agreement': float(self.sums['top1'] / n)}
+
+
+def evaluate(path: str, wb, prereq, chunk_size: int = 1000, min_count: float = 0):
+    '''Predict and score every target of an observed outcome file or training set.
+       Yields (chunk, metrics) per chunk (see observed_chunks and outcome_metrics);
+       pass them to an EvaluationSummary for the aggregates.'''
+    label, rev_index, features, frame_shift = prereq
+    for chunk in observed_chunks(path, label, chunk_size, min_count):
+        if len(chunk['sequence']):
+            y_pred, _ = gen_prediction_batch(chunk['sequence'], wb, prereq)
+        else:
+            y_pred = np.zeros((0, len(frame_shift)))
+        y_obs = merge_observed(chunk['y'].toarray(), chunk['sequence'], label)
+        yield chunk, outcome_metrics(y_pred, y_obs, frame_shift)
+
+
+EVALUATION_COLUMNS = ['Sequence', 'Reads', 'MSE', 'KL_Divergence', 'Frameshift_Predicted', 'Frameshift_Observed',
+                      'Top_Predicted', 'Top_Observed', 'Top1_Match']
+
+
+def evaluation_rows(chunk: dict, metrics: dict, rev_index) -> list:
+    '''Rows of EVALUATION_COLUMNS for one evaluated chunk'''
+    return [[seq, f"{total:g}", f"{mse:.6g}", f"{kl:.6g}", f"{fs_pred:.4f}", f"{fs_obs:.4f}",
+             rev_index[int(top_pred)], rev_index[int(top_obs)], int(top1)]
+            for seq, total, mse, kl, fs_pred, fs_obs, top_pred, top_obs, top1 in zip(
+                chunk['sequence'], chunk['total'], metrics['mse'], metrics['kl'], metrics['frameshift_pred'],
+                metrics['frameshift_obs'], metrics['top_pred'], metrics['top_obs'], metrics['top1'])]
@@ -0,0 +1,224 @@
+'''Similarity and threshold queries over stored outcome distributions.
+
+The index is the NPZ output of a batch run (--format npz, without
+--sparse-threshold): a dense (N x 557) float32 y_hat matrix with the class labels,
+names, sequences and frameshift ratios, memory-mapped in place by open_npz. The
+squared norm of every row is computed once and kept next to it in
+<index>.norms.npy. Queries scan y_hat in blocks of rows with one float32 matrix
+product per block for all query profiles, keeping a running top-k, so memory use
+does not depend on the number of targets.
+'''
+import os
+
+import numpy as np
+
+from .Columnar import open_npz
+
+NORMS_SUFFIX = '.norms.npy'
+BLOCK_ROWS = 32768
+METRICS = ('euclidean', 'cosine')
+
+
+class ProfileIndex:
+    """
+    Nearest-neighbour ('nearest') and class threshold ('where') queries over the
+    predicted outcome distributions of an NPZ prediction file. Rows of failed
+    predictions (all zero) never match.
+    """
+
+    def __init__(self, path: str, block_rows: int = BLOCK_ROWS):
+        self.path = path
+        self.block_rows = block_rows
+        arrays = open_npz(path)
+        if 'y_hat' not in arrays:
+            raise ValueError(f"{path}: no dense 'y_hat' member; write the index with --format npz "
+                             "and without --sparse-threshold")
+        self.y_hat = arrays['y_hat']
+        self.labels = [str(label) for label in arrays['labels']] if 'labels' in arrays else None
+        self.names = arrays.get('name')
+        self.sequences = arrays.get('sequence')
+        self.frameshift = arrays.get('frameshift_ratio')
+        self._class = {label: i for i, label in enumerate(self.labels or [])}
+        self.sq_norms = self._load_norms()
+
+    def __len__(self):
+        return len(self.y_hat)
+
+    def _blocks(self):
+        '''Consecutive row blocks of y_hat, copied only if unaligned (NPZ files not written by
+           NpzPredictionWriter), which would make the matrix products several times slower'''
+        for start in range(0, len(self.y_hat), self.block_rows):
+            yield start, np.require(self.y_hat[start:start + self.block_rows], requirements='A')
+
+    def _load_norms(self) -> np.ndarray:
+        '''Squared row norms from the sidecar file, computed and saved if missing or stale'''
+        norms_path = self.path + NORMS_SUFFIX
+        try:
+            if os.path.getmtime(norms_path) >= os.path.getmtime(self.path):
+                norms = np.load(norms_path, mmap_mode='r')
+                if norms.shape == (len(self.y_hat),):
+                    return norms
+        except (OSError, ValueError):
+            pass
+        norms = np.empty(len(self.y_hat), dtype=np.float32)
+        for start, block in self._blocks():
+            norms[start:start + len(block)] = np.einsum('ij,ij->i', block, block)
+        try:
+            np.save(norms_path, norms)
+        except OSError:
+            pass
+        return norms
+
+    def class_index(self, label) -> int:
+        '''Column of a class label (e.g. '1+A' or '-3+2'), or an integer column checked for range'''
+        if isinstance(label, (int, np.integer)):
+            if not 0 <= label < self.y_hat.shape[1]:
+                raise ValueError(f"Class index {label} out of range")
+            return int(label)
+        if label not in self._class:
+            raise ValueError(f"Unknown outcome class: {label}")
+        return self._class[label]
+
+    def profile(self, spec) -> np.ndarray:
+        '''A query profile as a float32 vector: from a vector of class probabilities or a
+           {label: probability} dict (other classes 0; not renormalised)'''
+        if isinstance(spec, dict):
+            q = np.zeros(self.y_hat.shape[1], dtype=np.float32)
+            for label, p in spec.items():
+                q[self.class_index(label)] = p
+            return q
+        q = np.asarray(spec, dtype=np.float32)
+        if q.shape[-1] != self.y_hat.shape[1]:
+            raise ValueError(f"Profile has {q.shape[-1]} classes, the index {self.y_hat.shape[1]}")
+        return q
+
+    def nearest(self, profiles, k: int = 10, metric: str = 'euclidean'):
+        '''The k stored distributions closest to each query profile (one profile or an
+           (m, n_class) array). Returns (indices, distances) of shape (m, k), or (k,) for a
+           single profile, nearest first. Distances are Euclidean or 1 - cosine similarity.'''
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric {metric!r}, expected one of {METRICS}")
+        single = isinstance(profiles, dict) or np.ndim(profiles) == 1
+        q = self.profile(profiles)[None] if single else np.vstack([self.profile(p) for p in profiles])
+        q_sq = np.einsum('ij,ij->i', q, q)
+        k = min(k, len(self))
+        # the float32 norm expansion cannot order profiles closer than ~1e-4, so keep more
+        # candidates than asked for and rank them by their exact distances
+        n_cand = min(2 * k + 16, len(self))
+        best_idx = np.zeros((len(q), 0), dtype=np.int64)
+        best_dist = np.zeros((len(q), 0), dtype=np.float32)
+        for start, block in self._blocks():
+            dots = q @ block.T
+            norms = np.asarray(self.sq_norms[start:start + len(block)])
+            if metric == 'euclidean':
+                dist = norms + q_sq[:, None] - 2 * dots
+            else:
+                dist = 1 - dots / np.sqrt(np.maximum(norms * q_sq[:, None], np.finfo(np.float32).tiny))
+            dist[:, norms == 0] = np.inf
+            idx, dist = _top_k(np.arange(start, start + len(block)), dist, n_cand)
+            best_idx, best_dist = _top_k(np.hstack((best_idx, idx)), np.hstack((best_dist, dist)), n_cand)
+        best_dist = np.where(np.isinf(best_dist), np.inf, self._distances(q, best_idx, metric))
+        order = np.lexsort((best_idx, best_dist), axis=1)[:, :k] if best_idx.size else best_idx[:, :k]
+        best_idx = np.take_along_axis(best_idx, order, axis=1)
+        best_dist = np.take_along_axis(best_dist, order, axis=1)
+        keep = np.isfinite(best_dist).all(axis=0)
+        best_idx, best_dist = best_idx[:, keep], best_dist[:, keep]
+        return (best_idx[0], best_dist[0]) if single else (best_idx, best_dist)
+
+    def _distances(self, q, idx, metric):
+        '''Exact (float64) distances of the query profiles to the stored rows idx (m, n)'''
+        uniq, inverse = np.unique(idx, return_inverse=True)
+        y = np.asarray(self.y_hat[uniq], dtype=np.float64)[inverse.reshape(idx.shape)]
+        q = q.astype(np.float64)[:, None]
+        if metric == 'euclidean':
+            return np.sqrt(((y - q) ** 2).sum(axis=2))
+        norms = np.linalg.norm(y, axis=2) * np.linalg.norm(q, axis=2)
+        return 1 - (y * q).sum(axis=2) / np.maximum(norms, np.finfo(np.float64).tiny)
+
+    def where(self, conditions: dict, limit: int = None) -> np.ndarray:
+        '''Indices of the stored distributions with probability >= p for every {class: p}
+           condition, ordered by decreasing probability of the first class'''
+        if not conditions:
+            raise ValueError('At least one class condition is required')
+        cols = np.array([self.class_index(label) for label in conditions], dtype=np.intp)
+        mins = np.array(list(conditions.values()), dtype=np.float32)
+        found, values = [], []
+        for start, block in self._blocks():
+            probs = block[:, cols]
+            rows = np.flatnonzero((probs >= mins).all(axis=1))
+            found.append(rows + start)
+            values.append(probs[rows, 0])
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+        found, values = np.concatenate(found), np.concatenate(values)
+        return found[np.argsort(-values, kind='stable')][:limit]
+
+
+def _top_k(idx, dist, k):
+    '''The k smallest distances of each row (unordered) with their indices; idx is either
+       per row or shared by all rows'''
+    if dist.shape[1] <= k:
+        return np.broadcast_to(idx, dist.shape), dist
+    top = np.argpartition(dist, k - 1, axis=1)[:, :k]
+    return (idx[top] if idx.ndim == 1 else np.take_along_axis(idx, top, axis=1)), np.take_along_axis(dist, top, axis=1)
+
+
+def parse_profile(text: str) -> dict:
+    '''Parse "label=p,label=p" into {label: p}'''
+    spec = {}
+    for item in filter(None, (part.strip() for part in text.split(','))):
+        label, sep, p = item.rpartition('=')
+        if not sep:
+            raise ValueError(f"Expected label=probability, got {item!r}")
+        spec[label.strip()] = float(p)
+    return spec
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Query the outcome distributions of an NPZ prediction file')
+    parser.add_argument('index', type=str, help='NPZ file written with --format npz (without --sparse-threshold)')
+    query = parser.add_mutually_exclusive_group(required=True)
+    query.add_argument('--like', type=str, metavar='PROFILE',
+                       help="Targets closest to a profile given as label=probability pairs, e.g. '1+A=0.6,-3+2=0.2'")
+    query.add_argument('--like-sequence', type=str, metavar='SEQUENCE',
+                       help='Targets closest to the predicted profile of a 60bp sequence')
+    query.add_argument('--where', type=str, metavar='CONDITIONS',
+                       help="Targets whose class probabilities reach every label=minimum pair, e.g. '1+A=0.5'")
+    parser.add_argument('-k', '--top', type=int, default=10, help='Number of targets to report (default: 10)')
+    parser.add_argument('--metric', choices=METRICS, default='euclidean',
+                        help='Distance for --like and --like-sequence (default: euclidean)')
+    args = parser.parse_args()
+
+    try:
+        index = ProfileIndex(args.index)
+        if args.where:
+            conditions = parse_profile(args.where)
+            rows = index.where(conditions, args.top)
+            cols = [index.class_index(label) for label in conditions]
+            print('\t'.join(['Index', 'Name', 'Sequence'] + list(conditions)))
+            for i in rows:
+                print('\t'.join([str(i), str(index.names[i]), str(index.sequences[i])] +
+                                [f"{index.y_hat[i, c]:.4f}" for c in cols]))
+            return
+        if args.like_sequence:
+            from .Model import load_model
+            from .Predictor import validate_sequence, gen_prediction_batch
+            is_valid, sequence = validate_sequence(args.like_sequence)
+            if not is_valid:
+                parser.error(sequence)
+            weights, prereq = load_model()
+            profile = gen_prediction_batch([sequence], weights, prereq)[0][0]
+        else:
+            profile = parse_profile(args.like)
+        rows, distances = index.nearest(profile, args.top, args.metric)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        raise SystemExit(1)
+    print('\t'.join(['Rank', 'Index', 'Name', 'Sequence', 'Distance', 'Frameshift_Ratio']))
+    for rank, (i, d) in enumerate(zip(rows, distances), 1):
+        print(f"{rank}\t{i}\t{index.names[i]}\t{index.sequences[i]}\t{d:.4f}\t{index.frameshift[i]:.4f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+'''Loading of the Lindel model weights and prerequisites.
+
+The model ships as two pickles, Model_weights.pkl (w1, b1, w2, b2, w3, b3) and
+model_prereq.pkl (label, rev_index, features, frame_shift). convert_model writes
+them once into a directory of plain .npy arrays that load without unpickling and
+are memory-mapped read-only, so forked worker processes share the same pages.
+load_model returns the (weights, prereq) tuples expected by Lindel.Predictor and
+caches them for the lifetime of the process.
+'''
+import os
+import json
+import pickle as pkl
+import threading
+
+import numpy as np
+
+from . import Predictor
+
+MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
+WEIGHTS_FILE = 'Model_weights.pkl'
+PREREQ_FILE = 'model_prereq.pkl'
+COMPACT_DIR = 'model_arrays'
+COMPACT_FORMAT = 1
+
+WEIGHT_NAMES = ('w1', 'b1', 'w2', 'b2', 'w3', 'b3')
+
+_MODEL_CACHE = {}
+_MODEL_LOCK = threading.Lock()
+
+
+def load_model(model_dir: str = None, compact: bool = True, use_cache: bool = True, dtype=np.float64) -> tuple:
+    """
+    Load the model as (weights, prereq), as used by gen_prediction.
+
+    The compact array format in <model_dir>/model_arrays is preferred when present
+    (and compact is True), otherwise the pickles are read. The result is cached per
+    directory, so repeated calls within a process are free; the returned arrays and
+    dictionaries are shared and must not be modified.
+
+    With dtype=np.float32 the weights are cast once to float32, and the batch
+    predictors then compute inputs and activations in float32 as well (half the
+    memory traffic, see Predictor.compare_precision for the loss of accuracy).
+    The prerequisites are shared with the float64 model.
+    """
+    dtype = np.dtype(dtype)
+    if dtype != np.float64:
+        key = (os.path.abspath(model_dir or MODEL_DIR), compact, dtype.name)
+        if use_cache and key in _MODEL_CACHE:
+            return _MODEL_CACHE[key]
+        weights, prereq = load_model(model_dir, compact, use_cache)
+        model = (tuple(np.asarray(w, dtype=dtype) for w in weights), prereq)
+        if use_cache:
+            _MODEL_CACHE[key] = model
+        return model
+    model_dir = os.path.abspath(model_dir or MODEL_DIR)
+    compact_dir = os.path.join(model_dir, COMPACT_DIR)
+    use_compact = compact and os.path.exists(os.path.join(compact_dir, 'manifest.json'))
+    key = (model_dir, use_compact)
+    if use_cache and key in _MODEL_CACHE:
+        return _MODEL_CACHE[key]
+    with _MODEL_LOCK:
+        if use_cache and key in _MODEL_CACHE:
+            return _MODEL_CACHE[key]
+        if use_compact:
+            model = _load_compact(compact_dir)
+        else:
+            model = _load_pickles(model_dir)
+        if use_cache:
+            _MODEL_CACHE[key] = model
+    return model
+
+
+def clear_model_cache():
+    '''Forget every model loaded by load_model'''
+    with _MODEL_LOCK:
+        _MODEL_CACHE.clear()
+
+
+def _load_pickles(model_dir):
+    with open(os.path.join(model_dir, WEIGHTS_FILE), 'rb') as f:
+        weights = pkl.load(f)
+    with open(os.path.join(model_dir, PREREQ_FILE), 'rb') as f:
+        prereq = pkl.load(f)
+    return tuple(weights), tuple(prereq)
+
+
+def _load_compact(compact_dir):
+    with open(os.path.join(compact_dir, 'manifest.json')) as f:
+        manifest = json.load(f)
+    if manifest.get('format') != COMPACT_FORMAT:
+        raise ValueError(f"Unsupported model array format: {manifest.get('format')}")
+
+    def array(name):
+        return np.load(os.path.join(compact_dir, name + '.npy'), mmap_mode='r')
+
+    weights = tuple(array(name) for name in WEIGHT_NAMES)
+    labels = array('labels').tolist()
+    feature_names = array('features').tolist()
+    label = {lb: i for i, lb in enumerate(labels)}
+    rev_index = dict(enumerate(labels))
+    features = {ft: i for i, ft in enumerate(feature_names)}
+    prereq = (label, rev_index, features, array('frame_shift'))
+
+    # the integer lookup tables are stored precomputed, seed them for Predictor
+    Predictor._seed_table('features', features, (array('feature_table'), array('insertion_features')))
+    Predictor._seed_table('labels', label, (array('merge_src'), array('merge_dst')))
+    return weights, prereq
+
+
+def convert_model(model_dir: str = None, out_dir: str = None) -> str:
+    """
+    Convert the pickled model in model_dir into the compact array format.
+
+    Writes one .npy file per array plus a manifest.json into out_dir (default
+    <model_dir>/model_arrays) and returns that directory. Class labels and feature
+    names are stored as string arrays ordered by their integer index, along with the
+    precomputed feature and class-merge tables used by gen_prediction_batch.
+    """
+    model_dir = os.path.abspath(model_dir or MODEL_DIR)
+    out_dir = out_dir or os.path.join(model_dir, COMPACT_DIR)
+    weights, prereq = _load_pickles(model_dir)
+    label, rev_index, features, frame_shift = prereq
+
+    labels = [rev_index[i] for i in range(len(rev_index))]
+    if any(label[lb] != i for i, lb in enumerate(labels)):
+        raise ValueError('label and rev_index of the model prerequisites disagree')
+    feature_names = [None] * len(features)
+    for ft, i in features.items():
+        feature_names[i] = ft
+
+    feature_table, ins_cols = Predictor._feature_table(features)
+    merge_src, merge_dst = Predictor._merge_table(label)
+    arrays = dict(zip(WEIGHT_NAMES, weights))
+    arrays.update(labels=np.array(labels), features=np.array(feature_names),
+                  frame_shift=np.asarray(frame_shift), feature_table=feature_table,
+                  insertion_features=ins_cols, merge_src=merge_src, merge_dst=merge_dst)
+
+    os.makedirs(out_dir, exist_ok=True)
+    for name, value in arrays.items():
+        np.save(os.path.join(out_dir, name + '.npy'), np.ascontiguousarray(value), allow_pickle=False)
+    with open(os.path.join(out_dir, 'manifest.json'), 'w') as f:
+        json.dump({'format': COMPACT_FORMAT, 'arrays': sorted(arrays)}, f, indent=1)
+    return out_dir
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Convert the pickled Lindel model into the compact array format')
+    parser.add_argument('--model-dir', type=str, default=None,
+                        help='Directory holding Model_weights.pkl and model_prereq.pkl (default: the Lindel package)')
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help=f'Output directory (default: <model-dir>/{COMPACT_DIR})')
+    args = parser.parse_args()
+    print(f"Model arrays written to: {convert_model(args.model_dir, args.output)}")
+
+
+if __name__ == '__main__':
+    main()
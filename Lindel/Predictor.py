@@ -1,8 +1,19 @@
 import numpy as np
-import scipy.sparse as sparse
 import re
+import gzip
+import io
+import sys
 import json
 import itertools
+import collections
+import functools
+
+from .Profile import profile_stage
+
+def _sparse():
+    '''scipy.sparse, imported on first use so that the dense paths do not load scipy'''
+    import scipy.sparse
+    return scipy.sparse
 
 def gen_indel(sequence: str, cut_site: int) -> list:
     """
@@ -10,36 +21,122 @@ def gen_indel(sequence: str, cut_site: int) -> list:
     which will be combined after.
     """
     nt = ['A', 'T', 'C', 'G']
-    up = sequence[:cut_site]
-    down = sequence[cut_site:]
-    dmax = min(len(up), len(down))
-    unique_seq = {}
-
-    # Deletions
-    for dstart in range(1, cut_site + 3):
-        for dlen in range(1, dmax):
-            if cut_site - 2 < dstart + dlen < len(sequence):
-                seq = sequence[:dstart] + sequence[dstart + dlen:]
-                indel = sequence[:dstart] + '-' * dlen + sequence[dstart + dlen:]
-                array = [indel, sequence, 13, 'del', dstart - 30, dlen, None, None, None]
-                if seq not in unique_seq or dstart - 30 < 1:
-                    unique_seq[seq] = array
+    t = indel_template(len(sequence), cut_site)
+    keep, mh, first = _collapse_deletions(np.frombuffer(sequence.encode(), dtype=np.uint8)[None, :], t)
+    uniq_align = []
+
+    # Deletions, in order of the first enumerated deletion giving each outcome
+    kept = np.flatnonzero(keep[0])
+    for c in kept[np.argsort(first[0, kept], kind='stable')]:
+        dstart, dlen, m = int(t.start[c]), int(t.length[c]), int(mh[0, c])
+        indel = sequence[:dstart] + '-' * dlen + sequence[dstart + dlen:]
+        if m:
+            uniq_align.append([indel, sequence, 13, 'del', dstart - 30, dlen,
+                               [(dstart - 30 - i, dlen) for i in range(m + 1)], 'mh', m])
+        else:
+            uniq_align.append([indel, sequence, 13, 'del', dstart - 30, dlen, None, None, 0])
 
     # Insertions
     for length in range(1, 3):
         for bases in itertools.product(nt, repeat=length):
             base_str = "".join(bases)
-            seq = sequence[:cut_site] + base_str + sequence[cut_site:]
             indel = sequence[:cut_site] + '-' * length + sequence[cut_site:]
-            array = [sequence, indel, 13, 'ins', 0, length, base_str, None, None]
-            unique_seq[seq] = array
-
-    uniq_align = label_mh(list(unique_seq.values()), 4)
-    for read in uniq_align:
-        if read[-2] == 'mh':
-            read[-3] = [(read[4] - i, read[5]) for i in range(read[-1] + 1)]
+            uniq_align.append([sequence, indel, 13, 'ins', 0, length, base_str, None, None])
     return uniq_align
 
+IndelTemplate = collections.namedtuple('IndelTemplate', ['start', 'length', 'prev', 'next', 'by_length',
+                                                         'mh_left', 'mh_right', 'mh_valid'])
+
+@functools.lru_cache(maxsize=None)
+def indel_template(seq_len: int = 60, cut_site: int = 30) -> IndelTemplate:
+    """
+    Candidate deletions enumerated by gen_indel for a sequence length and cut site,
+    as arrays in enumeration order: start and length of each deletion, the index of the
+    same-length deletion one base to the left/right (-1 if not a candidate), the
+    length-major ordering, and the base pairs compared to measure microhomology.
+    """
+    dmax = min(cut_site, seq_len - cut_site)
+    cand = [(dstart, dlen) for dstart in range(1, cut_site + 3) for dlen in range(1, dmax)
+            if cut_site - 2 < dstart + dlen < seq_len]
+    start = np.array([c[0] for c in cand], dtype=np.intp)
+    length = np.array([c[1] for c in cand], dtype=np.intp)
+    pos = {c: i for i, c in enumerate(cand)}
+    prev = np.array([pos.get((d - 1, l), -1) for d, l in cand], dtype=np.intp)
+    nxt = np.array([pos.get((d + 1, l), -1) for d, l in cand], dtype=np.intp)
+    by_length = np.lexsort((start, length))
+    j = np.arange(1, 5)
+    mh_left = start[:, None] - j
+    mh_right = (start + length)[:, None] - j
+    mh_valid = (j <= length[:, None]) & (mh_left >= 0)
+    return IndelTemplate(start, length, prev, nxt, by_length,
+                         np.maximum(mh_left, 0), mh_right, mh_valid)
+
+def _collapse_deletions(codes, t):
+    '''Vectorised duplicate-collapsing and microhomology labelling of the candidate deletions
+       of an (N, L) array of encoded bases. Returns (keep, mh, first): whether each candidate is
+       the deletion gen_indel keeps for its outcome, its microhomology length, and the index of
+       the first enumerated candidate with the same outcome
+    '''
+    # deletions (p, l) and (p + 1, l) give the same sequence when base p equals base p + l
+    linked_next = (codes[:, t.start] == codes[:, t.start + t.length]) & (t.next >= 0)
+    linked_prev = np.zeros_like(linked_next)
+    has_prev = t.prev >= 0
+    linked_prev[:, has_prev] = linked_next[:, t.prev[has_prev]]
+    # gen_indel keeps the last duplicate starting at or before position 30, else the first one
+    keep = np.where(t.start <= 30, ~(linked_next & (t.start < 30)), ~linked_prev)
+
+    matches = (codes[:, t.mh_left] == codes[:, t.mh_right]) & t.mh_valid
+    mh = np.cumprod(matches, axis=2, dtype=np.int8).sum(axis=2, dtype=np.int8)
+
+    n = codes.shape[0]
+    is_first = ~linked_prev[:, t.by_length]
+    group_start = np.maximum.accumulate(np.where(is_first, np.arange(len(t.start)), 0), axis=1)
+    first = np.empty((n, len(t.start)), dtype=np.intp)
+    first[:, t.by_length] = t.by_length[group_start]
+    return keep, mh, first
+
+def gen_indel_batch(codes, cut_site: int = 30):
+    '''Batch form of gen_indel over an (N, L) array from encode_sequences. Returns (keep, mh):
+       for each candidate deletion of indel_template, whether it is a unique outcome and its
+       microhomology length. The 20 insertions are the same for every sequence.
+    '''
+    t = indel_template(codes.shape[1], cut_site)
+    keep, mh, _ = _collapse_deletions(codes, t)
+    return keep, mh
+
+_NT_CODE = np.full(256, 255, dtype=np.uint8)
+for _i, _nt in enumerate('ATCG'):
+    _NT_CODE[ord(_nt)] = _i
+
+def encode_sequences(seqs) -> np.ndarray:
+    '''Encode a batch of equal-length sequences as an (N, L) uint8 array (A=0, T=1, C=2, G=3)'''
+    if isinstance(seqs, np.ndarray) and seqs.ndim == 2 and seqs.dtype == np.uint8:
+        codes = seqs
+    else:
+        seqs = _sequence_list(seqs)
+        if len(set(map(len, seqs))) > 1:
+            raise ValueError('All sequences in a batch must have the same length.')
+        raw = np.frombuffer(''.join(seqs).encode('ascii'), dtype=np.uint8)
+        codes = _NT_CODE[raw].reshape(len(seqs), -1 if seqs else 0)
+    if (codes > 3).any():
+        raise ValueError('Invalid characters in sequence. Only A, T, C, G allowed.')
+    return codes
+
+VALID_PAMS = ('AGG', 'TGG', 'CGG', 'GGG')
+
+def validate_sequence(sequence: str):
+    '''Check a target sequence: 60bp or longer (only the first 60bp are used), A/T/C/G only,
+       NGG PAM at positions 33-36. Returns (True, 60bp sequence) or (False, error message)'''
+    sequence = sequence.upper().strip()
+    if not re.match(r"^[ATCG]+$", sequence):
+        return False, "Invalid characters in sequence. Only A, T, C, G allowed."
+    if len(sequence) < 60:
+        return False, f"Sequence too short: {len(sequence)}bp. Need at least 60bp."
+    pam_region = sequence[33:36]
+    if pam_region not in VALID_PAMS:
+        return False, f"No valid PAM sequence found at position 33-36. Found: {pam_region}"
+    return True, sequence[:60]
+
 def label_mh(sample,mh_len):
     '''Function to label microhomology in deletion events'''
     for k in range(len(sample)):
@@ -79,33 +176,110 @@ def create_feature_array(ft,uniq_indels):
     return ft_array
 
 
+def feature_indices(ft,uniq_indels):
+    '''Active-index form of create_feature_array: the sorted feature columns set to 1'''
+    cols = set()
+    for read in uniq_indels:
+        key = str(read[4]) + '+' + str(read[5]) + '+' + str(read[-1] if read[-2] == 'mh' else 0)
+        if key in ft:
+            cols.add(ft[key])
+    return np.array(sorted(cols), dtype=np.intp)
+
+def create_feature_array_batch(ft,keep,mh,dtype=np.float64):
+    '''Batch form of create_feature_array over the (keep, mh) output of gen_indel_batch,
+       returns an (N, len(ft)) microhomology feature array
+    '''
+    table, ins_cols = _cached_table('features', ft, _feature_table)
+    ft_array = np.zeros((keep.shape[0], len(ft)), dtype=dtype)
+    rows, cand = np.nonzero(keep)
+    cols = table[cand, mh[rows, cand]]
+    found = cols >= 0
+    ft_array[rows[found], cols[found]] = 1
+    ft_array[:, ins_cols] = 1
+    return ft_array
+
+def _feature_table(ft):
+    '''Feature column of every (candidate deletion, microhomology length) of indel_template,
+       -1 when the model has no such feature, and the columns set by the insertions'''
+    t = indel_template()
+    table = np.array([[ft.get(f"{d - 30}+{l}+{m}", -1) for m in range(5)]
+                      for d, l in zip(t.start, t.length)], dtype=np.intp)
+    ins_cols = [ft[f"0+{l}+0"] for l in range(1, 3) if f"0+{l}+0" in ft]
+    return table, np.array(ins_cols, dtype=np.intp)
+
+_TABLE_CACHE = {}
+
+def _cached_table(kind, obj, build):
+    '''Memoise a lookup table derived from a model dictionary; the dictionaries
+       are treated as immutable once loaded'''
+    hit = _TABLE_CACHE.get((kind, id(obj)))
+    if hit is None or hit[0] is not obj:
+        hit = (obj, build(obj))
+        _TABLE_CACHE[(kind, id(obj))] = hit
+    return hit[1]
+
+def _seed_table(kind, obj, table):
+    '''Register a precomputed lookup table for a model dictionary (see Lindel.Model)'''
+    _TABLE_CACHE[(kind, id(obj))] = (obj, table)
+
 def onehotencoder(seq: str) -> np.ndarray:
     """Converts sequence to single and di-nucleotide one-hot encoding."""
-    nt = ['A', 'T', 'C', 'G']
-    l = len(seq)
-    
-    # Pre-calculate sizes for efficiency
-    single_nt_size = len(nt) * l
-    di_nt_size = len(nt) * len(nt) * (l - 1)
-    total_size = single_nt_size + di_nt_size
-
-    # Create a mapping from nucleotide/dinucleotide to index
-    head_idx = {char + str(i): i * len(nt) + j for i in range(l) for j, char in enumerate(nt)}
-    offset = single_nt_size
-    for i in range(l - 1):
-        for j, char1 in enumerate(nt):
-            for k, char2 in enumerate(nt):
-                head_idx[char1 + char2 + str(i)] = offset + i * (len(nt) * len(nt)) + j * len(nt) + k
-
-    # Create the one-hot encoded array
-    encode = np.zeros(total_size)
-    for j, char in enumerate(seq):
-        encode[head_idx[char + str(j)]] = 1.0
-    for k in range(l - 1):
-        encode[head_idx[seq[k:k+2] + str(k)]] = 1.0
-        
+    return onehotencoder_batch(encode_sequences([seq]))[0]
+
+def onehot_indices(codes: np.ndarray) -> np.ndarray:
+    """
+    Column indices of the nonzero entries of the single and di-nucleotide one-hot
+    encoding of an (N, L) array from encode_sequences, as an (N, 2L - 1) array.
+    Single nucleotides occupy the first 4 * L columns (position-major, A/T/C/G),
+    followed by 16 columns per dinucleotide position.
+    """
+    l = codes.shape[1]
+    codes = codes.astype(np.intp)
+    single = np.arange(l) * 4 + codes
+    di = 4 * l + np.arange(l - 1) * 16 + codes[:, :-1] * 4 + codes[:, 1:]
+    return np.hstack((single, di))
+
+def onehotencoder_batch(codes: np.ndarray, output: str = 'dense', dtype=np.float64):
+    """
+    Batch form of onehotencoder over an (N, L) array from encode_sequences.
+    output='dense' returns an (N, 20L - 12) array, 'sparse' a scipy CSR matrix and
+    'index' the (N, 2L - 1) nonzero column indices from onehot_indices.
+    """
+    idx = onehot_indices(codes)
+    if output == 'index':
+        return idx
+    n, l = codes.shape
+    size = 4 * l + 16 * (l - 1)
+    if output == 'sparse':
+        indptr = np.arange(0, idx.size + 1, idx.shape[1])
+        return _sparse().csr_matrix((np.ones(idx.size, dtype=dtype), idx.ravel(), indptr), shape=(n, size))
+    if output != 'dense':
+        raise ValueError(f"Unknown one-hot output type: {output}")
+    encode = np.zeros((n, size), dtype=dtype)
+    np.put_along_axis(encode, idx, 1, axis=1)
     return encode
 
+def sparse_inputs_batch(codes,ft,keep,mh,dtype=np.float64):
+    '''Active-index form of the three head inputs of _predict_heads (guide one-hot, microhomology
+       features + guide one-hot, last 6bp one-hot) as binary scipy CSR matrices'''
+    table, ins_cols = _cached_table('features', ft, _feature_table)
+    n = len(codes)
+    guide = onehot_indices(codes[:,13:33])
+    tail  = onehot_indices(codes[:,27:33])
+    rows, cand = np.nonzero(keep)
+    cols = table[cand, mh[rows, cand]]
+    found = cols >= 0
+    del_rows = np.concatenate((rows[found],np.repeat(np.arange(n),len(ins_cols)+guide.shape[1])))
+    del_cols = np.concatenate((cols[found],np.hstack((np.tile(ins_cols,(n,1)),guide+len(ft))).ravel()))
+    input_del = _sparse().csr_matrix((np.ones(len(del_rows),dtype=dtype),(del_rows,del_cols)),
+                                  shape=(n,len(ft)+4*20+16*19))
+    input_del.data[:] = 1 # a feature set by several deletions is still 1
+    return (_onehot_csr(guide,4*20+16*19,dtype),input_del,_onehot_csr(tail,4*6+16*5,dtype))
+
+def _onehot_csr(idx,width,dtype=np.float64):
+    indptr = np.arange(0,idx.size+1,idx.shape[1])
+    return _sparse().csr_matrix((np.ones(idx.size,dtype=dtype),idx.ravel(),indptr),shape=(len(idx),width))
+
 def create_label_array(lb,ep_freq,seq):
     lb_array = np.zeros(len(lb))
     for pt in ep_freq[seq]['del']:
@@ -115,31 +289,172 @@ def create_label_array(lb,ep_freq,seq):
     return lb_array
 
 
-def gen_prediction(seq,wb,prereq):
-    '''generate the prediction for all classes, redundant classes will be combined'''
+def gen_prediction(seq,wb,prereq,sparse_inputs=False):
+    '''generate the prediction for all classes, redundant classes will be combined.
+       With sparse_inputs, each head sums the weight rows of its active inputs
+       instead of multiplying the dense input vectors
+    '''
     pam = {'AGG':0,'TGG':0,'CGG':0,'GGG':0}
     guide = seq[13:33]
     if seq[33:36] not in pam:
         return ('Error: No PAM sequence is identified.')
     w1,b1,w2,b2,w3,b3 = wb
     label,rev_index,features,frame_shift = prereq
-    indels = gen_indel(seq,30) 
-    input_indel = onehotencoder(guide)
-    input_ins   = onehotencoder(guide[-6:])
-    input_del   = np.concatenate((create_feature_array(features,indels),input_indel),axis=None)
-    cmax = gen_cmatrix(indels,label) # combine redundant classes
-    dratio, insratio = softmax(np.dot(input_indel,w1)+b1)
-    ds  = softmax(np.dot(input_del,w2)+b2)
-    ins = softmax(np.dot(input_ins,w3)+b3)
-    y_hat = np.concatenate((ds*dratio,ins*insratio),axis=None) * cmax
+    with profile_stage('indels',1):
+        indels = gen_indel(seq,30) 
+    if sparse_inputs:
+        with profile_stage('features',1):
+            idx_indel = onehot_indices(encode_sequences([guide]))[0]
+            idx_ins   = onehot_indices(encode_sequences([guide[-6:]]))[0]
+            idx_del   = np.concatenate((feature_indices(features,indels),idx_indel+len(features)))
+        with profile_stage('heads',1):
+            dratio, insratio = softmax(w1[idx_indel].sum(axis=0)+b1)
+            ds  = softmax(w2[idx_del].sum(axis=0)+b2)
+            ins = softmax(w3[idx_ins].sum(axis=0)+b3)
+    else:
+        with profile_stage('features',1):
+            input_indel = onehotencoder(guide)
+            input_ins   = onehotencoder(guide[-6:])
+            input_del   = np.concatenate((create_feature_array(features,indels),input_indel),axis=None)
+        with profile_stage('heads',1):
+            dratio, insratio = softmax(np.dot(input_indel,w1)+b1)
+            ds  = softmax(np.dot(input_del,w2)+b2)
+            ins = softmax(np.dot(input_ins,w3)+b3)
+    with profile_stage('merge',1):
+        merge = gen_merge_index(indels,label) # combine redundant classes
+        y_hat = merge_classes(np.concatenate((ds*dratio,ins*insratio),axis=None),merge)
+    return (y_hat,np.dot(y_hat,frame_shift))
+
+def gen_prediction_batch(seqs,wb,prereq,sparse_inputs=False):
+    '''generate the prediction for a batch of sequences, redundant classes will be combined.
+       seqs is a list of 60bp sequences or an (N, 60) character array; returns the
+       (N, 557) class probabilities and the N frameshift ratios. sparse_inputs as for
+       _predict_heads
+    '''
+    label,rev_index,features,frame_shift = prereq
+    with profile_stage('encode',len(seqs)):
+        codes = encode_sequences(seqs)
+    if len(codes) == 0:
+        return (np.zeros((0,len(frame_shift))),np.zeros(0))
+    ratios, ds, ins, keep, mh = _predict_heads(codes,wb,prereq,sparse_inputs)
+    with profile_stage('merge',len(codes)):
+        y_hat = np.hstack((ds*ratios[:,:1],ins*ratios[:,1:2]))
+        y_hat = merge_classes(y_hat,gen_merge_index_batch(label,keep,mh)) # combine redundant classes
     return (y_hat,np.dot(y_hat,frame_shift))
 
+def gen_frameshift_batch(seqs,wb,prereq,return_ratios=False,sparse_inputs=False):
+    '''frameshift ratios of a batch of sequences without building the merged class distribution.
+       With return_ratios, also returns the deletion and insertion ratios: (fs, del_ratio, ins_ratio)
+    '''
+    label,rev_index,features,frame_shift = prereq
+    with profile_stage('encode',len(seqs)):
+        codes = encode_sequences(seqs)
+    if len(codes) == 0:
+        return (np.zeros(0),np.zeros(0),np.zeros(0)) if return_ratios else np.zeros(0)
+    ratios, ds, ins, keep, mh = _predict_heads(codes,wb,prereq,sparse_inputs)
+    with profile_stage('merge',len(codes)):
+        n_del = ds.shape[1]
+        fs = ratios[:,0]*np.dot(ds,frame_shift[:n_del]) + ratios[:,1]*np.dot(ins,frame_shift[n_del:])
+        # merging moves probability between deletion classes, correct for any change of frame it implies
+        rows, src, dst = gen_merge_index_batch(label,keep,mh)
+        np.add.at(fs,rows,ds[rows,src]*ratios[rows,0]*(frame_shift[dst]-frame_shift[src]))
+    if return_ratios:
+        return (fs,ratios[:,0],ratios[:,1])
+    return fs
+
+def _predict_heads(codes,wb,prereq,sparse_inputs=False):
+    '''Evaluate the three softmax heads for encoded sequences: returns the (N, 2) deletion/insertion
+       ratios, the deletion and insertion class distributions, and the (keep, mh) indel labelling.
+       With sparse_inputs the inputs are kept as binary CSR matrices (sparse_inputs_batch), so
+       the logits are sums of the weight rows of the active inputs rather than dense products.
+       Inputs and activations take the dtype of the weights (see Model.load_model(dtype=...))
+    '''
+    w1,b1,w2,b2,w3,b3 = wb
+    label,rev_index,features,frame_shift = prereq
+    bad = np.flatnonzero((codes[:,34] != 3) | (codes[:,35] != 3)) # NGG
+    if len(bad):
+        raise ValueError('Error: No PAM sequence is identified (batch rows %s).' % bad[:10].tolist())
+    n = len(codes)
+    dtype = np.result_type(w1,w2,w3)
+    with profile_stage('indels',n):
+        keep, mh = gen_indel_batch(codes,30)
+    if sparse_inputs:
+        with profile_stage('features',n):
+            input_indel, input_del, input_ins = sparse_inputs_batch(codes,features,keep,mh,dtype)
+        with profile_stage('heads',n):
+            ratios = _softmax_rows(input_indel@w1+b1)
+            ds  = _softmax_rows(input_del@w2+b2)
+            ins = _softmax_rows(input_ins@w3+b3)
+        return ratios, ds, ins, keep, mh
+    with profile_stage('features',n):
+        input_indel = onehotencoder_batch(codes[:,13:33],dtype=dtype)
+        input_ins   = onehotencoder_batch(codes[:,27:33],dtype=dtype)
+        input_del   = np.hstack((create_feature_array_batch(features,keep,mh,dtype),input_indel))
+    with profile_stage('heads',n):
+        ratios = _softmax_rows(np.dot(input_indel,w1)+b1)
+        ds  = _softmax_rows(np.dot(input_del,w2)+b2)
+        ins = _softmax_rows(np.dot(input_ins,w3)+b3)
+    return ratios, ds, ins, keep, mh
+
+def _sequence_list(seqs):
+    '''Normalise a batch of sequences (list of str, or an (N, L) array of characters) to a list of str'''
+    if isinstance(seqs, str):
+        return [seqs]
+    if isinstance(seqs, np.ndarray) and seqs.ndim == 2:
+        if seqs.dtype.kind == 'S':
+            return [row.tobytes().decode('ascii') for row in seqs]
+        return [''.join(row) for row in seqs]
+    return [seq.decode('ascii') if isinstance(seq, bytes) else str(seq) for seq in seqs]
+
 def softmax(weights):
-    return (np.exp(weights)/sum(np.exp(weights)))
+    '''Softmax of a vector of logits, shifted by the maximum so large logits cannot overflow'''
+    e = np.exp(weights - np.max(weights))
+    return e/e.sum()
+
+def _softmax_rows(weights):
+    '''Row-wise softmax over a 2D array of logits'''
+    e = np.exp(weights - weights.max(axis=1, keepdims=True))
+    return e/e.sum(axis=1, keepdims=True)
+
+def compare_precision(seqs,wb,prereq,dtype=np.float32,chunk_size=1000,sparse_inputs=False):
+    '''Deviation of predictions with weights cast to dtype from the predictions of wb.
+       Returns the max and mean absolute differences of the class probabilities and the
+       frameshift ratios, and the fraction of sequences with the same top class
+    '''
+    wb_low = tuple(np.asarray(w,dtype=dtype) for w in wb)
+    n, max_p, sum_p, max_fs, sum_fs, top1 = 0, 0.0, 0.0, 0.0, 0.0, 0
+    seqs = _sequence_list(seqs)
+    for start in range(0,len(seqs),chunk_size):
+        chunk = seqs[start:start+chunk_size]
+        y_ref, fs_ref = gen_prediction_batch(chunk,wb,prereq,sparse_inputs)
+        y_low, fs_low = gen_prediction_batch(chunk,wb_low,prereq,sparse_inputs)
+        dp = np.abs(y_low.astype(np.float64)-y_ref)
+        dfs = np.abs(fs_low-fs_ref)
+        n += len(chunk)
+        max_p, sum_p = max(max_p,float(dp.max())), sum_p+float(dp.sum())
+        max_fs, sum_fs = max(max_fs,float(dfs.max())), sum_fs+float(dfs.sum())
+        top1 += int((y_low.argmax(axis=1) == y_ref.argmax(axis=1)).sum())
+    n_class = len(prereq[3])
+    return {'sequences': n, 'dtype': np.dtype(dtype).name,
+            'max_abs_probability': max_p, 'mean_abs_probability': sum_p/(n*n_class) if n else 0.0,
+            'max_abs_frameshift': max_fs, 'mean_abs_frameshift': sum_fs/n if n else 0.0,
+            'top1_agreement': top1/n if n else 1.0}
 
 def gen_cmatrix(indels,label): 
     ''' Combine redundant classes based on microhomology, matrix operation'''
-    combine = []
+    src, dst = gen_merge_index(indels,label)
+    n = len(label)
+    keep = np.ones(n, dtype=bool)
+    keep[src] = False
+    rows = np.concatenate((np.flatnonzero(keep),src))
+    cols = np.concatenate((np.flatnonzero(keep),dst))
+    return (_sparse().csr_matrix((np.ones(len(rows)),(rows,cols)),shape=(n,n)))
+
+def gen_merge_index(indels,label):
+    ''' Combine redundant classes based on microhomology, index form of gen_cmatrix.
+        Returns (src, dst): the probability of class src[k] is moved onto class dst[k]
+    '''
+    pairs = {}
     for s in indels:
         if s[-2] == 'mh':
             tmp = []
@@ -148,14 +463,101 @@ def gen_cmatrix(indels,label):
                     tmp.append(label['+'.join(list(map(str,k)))])
                 except KeyError:
                     pass
-            if len(tmp)>1:
-                combine.append(tmp)
-    temp = np.diag(np.ones(557), 0)
-    for key in combine:
-        for i in key[1:]:
-            temp[i,key[0]] = 1
-            temp[i,i]=0    
-    return (sparse.csr_matrix(temp))
+            for i in tmp[1:]:
+                pairs[(i,tmp[0])] = None
+    if not pairs:
+        return (np.zeros(0,dtype=np.intp),np.zeros(0,dtype=np.intp))
+    src, dst = np.array(list(pairs),dtype=np.intp).T
+    return (src,dst)
+
+def gen_merge_index_batch(label,keep,mh):
+    '''Batch form of gen_merge_index over the (keep, mh) output of gen_indel_batch,
+       returns a (rows, src, dst) index for merge_classes
+    '''
+    msrc, mdst = _cached_table('labels', label, _merge_table)
+    rows, cand = np.nonzero(keep & (mh > 0))
+    src = msrc[cand, mh[rows, cand]]
+    dst = mdst[cand, mh[rows, cand]]
+    found = src >= 0
+    rows = np.broadcast_to(rows[:, None], src.shape)
+    return (rows[found],src[found],dst[found])
+
+def _merge_table(label):
+    '''(src, dst) class pairs merged by gen_merge_index for every (candidate deletion,
+       microhomology length) of indel_template, padded with -1'''
+    t = indel_template()
+    msrc = np.full((len(t.start), 5, 4), -1, dtype=np.intp)
+    mdst = np.full((len(t.start), 5, 4), -1, dtype=np.intp)
+    for c, (d, l) in enumerate(zip(t.start, t.length)):
+        for m in range(1, 5):
+            tmp = [label[k] for k in (f"{d - 30 - i}+{l}" for i in range(m + 1)) if k in label]
+            if len(tmp) > 1:
+                msrc[c, m, :len(tmp) - 1] = tmp[1:]
+                mdst[c, m, :len(tmp) - 1] = tmp[0]
+    return msrc, mdst
+
+def merge_index_batch(merges):
+    '''Stack per-sequence (src, dst) merge indexes into a batched (rows, src, dst) index'''
+    if not merges:
+        return (np.zeros(0,dtype=np.intp),np.zeros(0,dtype=np.intp),np.zeros(0,dtype=np.intp))
+    rows = np.repeat(np.arange(len(merges)),[len(src) for src, _ in merges])
+    src = np.concatenate([src for src, _ in merges])
+    dst = np.concatenate([dst for _, dst in merges])
+    return (rows,src,dst)
+
+def merge_classes(y_hat,merge):
+    '''Combine redundant classes of y_hat: a vector with a (src, dst) index from gen_merge_index,
+       or an (N, 557) matrix with a (rows, src, dst) index from merge_index_batch
+    '''
+    *rows, src, dst = merge
+    moved = y_hat[(*rows,src)]
+    y_hat = y_hat.copy()
+    y_hat[(*rows,src)] = 0
+    np.add.at(y_hat,(*rows,dst),moved)
+    return y_hat
+
+def top_k_classes(y_hat,k):
+    '''Indices and probabilities of the k most likely classes of each row of an (N, 557) y_hat,
+       in decreasing order of probability (ties by class index). Classes with zero
+       probability are reported with index -1.
+    '''
+    y_hat = np.atleast_2d(y_hat)
+    n, n_class = y_hat.shape
+    k = max(0, min(k, n_class))
+    if k < n_class:
+        part = np.argpartition(-y_hat, k - 1, axis=1)[:, :k] if k else np.zeros((n, 0), dtype=np.intp)
+    else:
+        part = np.broadcast_to(np.arange(n_class), (n, n_class))
+    prob = np.take_along_axis(y_hat, part, axis=1)
+    order = np.lexsort((part, -prob))
+    idx = np.take_along_axis(part, order, axis=1)
+    prob = np.take_along_axis(prob, order, axis=1)
+    return np.where(prob != 0, idx, -1), prob
+
+ClassTable = collections.namedtuple('ClassTable', ['labels', 'is_insertion', 'size', 'start', 'bases'])
+
+def class_table(rev_index) -> ClassTable:
+    '''Metadata of every outcome class parsed once from rev_index: label, whether it is an
+       insertion, its size (3 for the >=3bp insertion class), the start of a deletion relative
+       to the cut site and the inserted bases ('X' for the >=3bp class)
+    '''
+    return _cached_table('classes', rev_index, _class_table)
+
+def _class_table(rev_index):
+    labels = [rev_index[i] for i in range(len(rev_index))]
+    is_insertion = np.zeros(len(labels), dtype=bool)
+    size = np.zeros(len(labels), dtype=np.intp)
+    start = np.zeros(len(labels), dtype=np.intp)
+    bases = [''] * len(labels)
+    for i, pt in enumerate(labels):
+        first, _, second = pt.partition('+')
+        if second.lstrip('-').isdigit():
+            start[i], size[i] = int(first), int(second)
+        else:
+            is_insertion[i] = True
+            bases[i] = second if second else 'X'
+            size[i] = len(second) if second else 3
+    return ClassTable(labels, is_insertion, size, start, bases)
 
 def format_predictions(seq: str, pred_sorted: list, pred_freq: dict, output_type: str = 'json', fname: str = None):
     """Formats predictions into JSON or a file."""
@@ -211,3 +613,20 @@ def format_predictions(seq: str, pred_sorted: list, pred_freq: dict, output_type
     else:
         return None
 
+GZIP_MAGIC = b'\x1f\x8b'
+
+def open_input(path: str, binary: bool = False):
+    '''Open an input file for streaming reads, as text unless binary. '-' is standard
+       input, which is left open when the returned stream is closed. Gzip-compressed
+       input is detected from its magic number.
+    '''
+    if path == '-':
+        stream = open(sys.stdin.fileno(), 'rb', closefd=False)
+        if stream.peek(2)[:2] == GZIP_MAGIC:
+            stream = gzip.GzipFile(fileobj=stream)
+    else:
+        with open(path, 'rb') as f:
+            gzipped = f.read(2) == GZIP_MAGIC
+        # gzip.open owns the file it opens, unlike GzipFile(fileobj=...)
+        stream = gzip.open(path) if gzipped else open(path, 'rb')
+    return stream if binary else io.TextIOWrapper(stream)
@@ -0,0 +1,94 @@
+'''Optional per-stage instrumentation of the prediction pipeline.
+
+Stages of Lindel.Predictor (encode, indels, features, heads, merge) and of the
+batch tool (validate, predict, cache, rank, format, write) are wrapped in
+profile_stage(name, n). When profiling is off, profile_stage returns a shared
+no-op context manager, so the cost is one function call per stage and batch.
+
+Profiling is enabled with the LINDEL_PROFILE environment variable (any value but
+'' or '0') or enable_profiling(). Timings and counters accumulate in PROFILER.
+'''
+import collections
+import contextlib
+import os
+import time
+
+
+class StageProfile:
+    """Cumulative wall time, call count and items (sequences) per stage, plus named counters."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.seconds = collections.defaultdict(float)
+        self.calls = collections.Counter()
+        self.items = collections.Counter()
+        self.counters = collections.Counter()
+
+    @contextlib.contextmanager
+    def stage(self, name: str, n: int = 0):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - start
+            self.calls[name] += 1
+            self.items[name] += n
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] += n
+
+    def snapshot(self) -> dict:
+        '''Plain-dict copy of the profile, e.g. to send from a worker process'''
+        return {'seconds': dict(self.seconds), 'calls': dict(self.calls), 'items': dict(self.items),
+                'counters': dict(self.counters)}
+
+    def merge(self, snapshot: dict):
+        '''Add a snapshot (from another process) to this profile'''
+        for name, seconds in snapshot['seconds'].items():
+            self.seconds[name] += seconds
+        self.calls.update(snapshot['calls'])
+        self.items.update(snapshot['items'])
+        self.counters.update(snapshot['counters'])
+
+    def summary(self, wall_seconds: float = None, sequences: int = None) -> str:
+        '''Table of stages by total time, with sequences/s per stage and, given the wall
+           time and sequence count of a run, overall throughput'''
+        lines = [f"{'Stage':<12}{'Calls':>8}{'Items':>10}{'Seconds':>11}{'Share':>8}{'Items/s':>12}"]
+        total = sum(self.seconds.values())
+        for name in sorted(self.seconds, key=self.seconds.get, reverse=True):
+            seconds, items = self.seconds[name], self.items[name]
+            rate = f"{items / seconds:>12,.0f}" if items and seconds > 0 else f"{'-':>12}"
+            share = seconds / wall_seconds if wall_seconds else seconds / total if total else 0.0
+            lines.append(f"{name:<12}{self.calls[name]:>8}{items:>10}{seconds:>11.3f}{share:>8.1%}{rate}")
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"{name}: {value}")
+        if wall_seconds is not None:
+            lines.append(f"Wall time: {wall_seconds:.3f}s"
+                         + (f", {sequences / wall_seconds:,.0f} sequences/s" if sequences and wall_seconds > 0 else ''))
+        return '\n'.join(lines)
+
+
+PROFILER = StageProfile()
+_ENABLED = os.environ.get('LINDEL_PROFILE', '') not in ('', '0')
+_NO_PROFILE = contextlib.nullcontext()
+
+
+def enable_profiling(enabled: bool = True):
+    global _ENABLED
+    _ENABLED = enabled
+
+
+def profiling_enabled() -> bool:
+    return _ENABLED
+
+
+def profile_stage(name: str, n: int = 0):
+    '''Context manager timing a stage over n items when profiling is enabled'''
+    return PROFILER.stage(name, n) if _ENABLED else _NO_PROFILE
+
+
+def profile_count(name: str, n: int = 1):
+    if _ENABLED:
+        PROFILER.count(name, n)
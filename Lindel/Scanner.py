@@ -0,0 +1,125 @@
+'''Scanning of FASTA sequences for SpCas9 target sites.
+
+Every NGG PAM on either strand with a full 60bp context (30bp either side of the
+cut site, no ambiguous bases) is scored with gen_prediction_batch. Records are
+held as encoded uint8 buffers and the 60bp windows are strided views into them,
+so no Python string is built per site.
+'''
+import gzip
+
+import numpy as np
+
+from .Predictor import gen_prediction_batch, top_k_classes, open_input
+
+# A/T/C/G (either case) to the codes of Predictor.encode_sequences, anything else to 4
+_FASTA_CODE = np.full(256, 4, dtype=np.uint8)
+for _i, _nt in enumerate('ATCG'):
+    _FASTA_CODE[ord(_nt)] = _i
+    _FASTA_CODE[ord(_nt.lower())] = _i
+_BASES = np.frombuffer(b'ATCGN', dtype=np.uint8)
+
+WINDOW = 60
+PAM_OFFSET = 33
+CUT_OFFSET = 30
+
+SCAN_COLUMNS = ['Chrom', 'Start', 'End', 'Strand', 'Cut_Position', 'Guide', 'PAM', 'Frameshift_Ratio', 'Top_Outcomes']
+
+
+def read_fasta(path: str):
+    '''Yield (name, codes) for every record of a FASTA file (optionally gzipped, '-' for stdin),
+       codes being the record encoded as a uint8 array with ambiguous bases as 4'''
+    with open_input(path, binary=True) as f:
+        name, parts = None, []
+        for line in f:
+            if line.startswith(b'>'):
+                if name is not None:
+                    yield name, _FASTA_CODE[np.frombuffer(b''.join(parts), dtype=np.uint8)]
+                header = line[1:].decode().split()
+                name, parts = header[0] if header else '', []
+            else:
+                parts.append(line.rstrip())
+        if name is not None:
+            yield name, _FASTA_CODE[np.frombuffer(b''.join(parts), dtype=np.uint8)]
+
+
+def find_sites(codes: np.ndarray, start: int = 0, stop: int = None) -> np.ndarray:
+    '''Start positions of the 60bp windows of codes whose PAM (window positions 33-36)
+       is NGG and which contain no ambiguous base, for windows starting in [start, stop)'''
+    n = len(codes) - WINDOW + 1
+    stop = n if stop is None else min(stop, n)
+    if stop <= start:
+        return np.zeros(0, dtype=np.intp)
+    window = codes[start:stop + WINDOW - 1]
+    starts = np.flatnonzero((window[PAM_OFFSET + 1:PAM_OFFSET + 1 + stop - start] == 3) &
+                            (window[PAM_OFFSET + 2:PAM_OFFSET + 2 + stop - start] == 3))
+    if len(starts):
+        ambiguous = np.concatenate(([0], np.cumsum(window > 3)))
+        starts = starts[ambiguous[starts + WINDOW] == ambiguous[starts]]
+    return starts + start
+
+
+def reverse_complement(codes: np.ndarray) -> np.ndarray:
+    '''Reverse complement of encoded bases (A<->T and C<->G are codes 0<->1 and 2<->3)'''
+    rc = codes[::-1].copy()
+    rc[rc < 4] ^= 1
+    return rc
+
+
+def scan_sites(codes: np.ndarray, segment: int = 1 << 20):
+    '''Yield (strand, strand_codes, starts) for the target sites of an encoded record,
+       in segments of at most `segment` window positions per strand'''
+    for strand, strand_codes in (('+', codes), ('-', reverse_complement(codes))):
+        for start in range(0, max(len(codes) - WINDOW + 1, 0), segment):
+            starts = find_sites(strand_codes, start, start + segment)
+            if len(starts):
+                yield strand, strand_codes, starts
+
+
+def scan_fasta(fasta: str, wb, prereq, chunk_size: int = 1000, top_n: int = 3):
+    '''Score every SpCas9 target site of a FASTA file.
+
+       Yields one dict per site with the record name, the forward-strand window
+       [start, end), strand, cut position (0-based index of the base right of the cut
+       on the forward strand), guide, PAM, frameshift ratio and the top_n outcomes as
+       (label, probability) pairs.
+    '''
+    rev_index = prereq[1]
+    for name, codes in read_fasta(fasta):
+        length = len(codes)
+        for strand, strand_codes, starts in scan_sites(codes):
+            windows = np.lib.stride_tricks.sliding_window_view(strand_codes, WINDOW)
+            for k in range(0, len(starts), chunk_size):
+                chunk = starts[k:k + chunk_size]
+                batch = windows[chunk]
+                y_hat, fs = gen_prediction_batch(batch, wb, prereq)
+                top, top_p = top_k_classes(y_hat, top_n)
+                for j, s in enumerate(chunk):
+                    if strand == '+':
+                        start, cut = int(s), int(s) + CUT_OFFSET
+                    else:
+                        start, cut = length - int(s) - WINDOW, length - int(s) - CUT_OFFSET
+                    yield {
+                        'chrom': name,
+                        'start': start,
+                        'end': start + WINDOW,
+                        'strand': strand,
+                        'cut_position': cut,
+                        'guide': _BASES[batch[j, 13:33]].tobytes().decode(),
+                        'pam': _BASES[batch[j, 33:36]].tobytes().decode(),
+                        'frameshift_ratio': float(fs[j]),
+                        'top_outcomes': [(rev_index[c], p) for c, p in zip(top[j].tolist(), top_p[j].tolist()) if c >= 0],
+                    }
+
+
+def write_scan_tsv(sites, output_file: str) -> int:
+    '''Write scan_fasta results as TSV, returns the number of sites written'''
+    count = 0
+    opener = gzip.open if output_file.endswith('.gz') else open
+    with opener(output_file, 'wt') as f:
+        f.write('\t'.join(SCAN_COLUMNS) + '\n')
+        for site in sites:
+            top = ','.join(f"{lb}:{p * 100:.2f}" for lb, p in site['top_outcomes'])
+            f.write(f"{site['chrom']}\t{site['start']}\t{site['end']}\t{site['strand']}\t{site['cut_position']}\t"
+                    f"{site['guide']}\t{site['pam']}\t{site['frameshift_ratio']:.4f}\t{top}\n")
+            count += 1
+    return count
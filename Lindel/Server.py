@@ -0,0 +1,346 @@
+'''Local HTTP prediction service.
+
+A dependency-free asyncio HTTP/1.1 server that loads the model once and serves
+predictions as JSON:
+
+    POST /predict        {"sequence": "...", "top_n": 20}
+    POST /predict/batch  {"sequences": ["...", ...], "top_n": 20}   (up to 100 sequences)
+    GET  /metrics        request, batch and latency statistics
+    GET  /health
+
+Sequences of concurrent requests are queued and coalesced into micro-batches of
+at most max_batch sequences, waiting at most max_wait seconds for a batch to fill,
+and each batch is scored with one gen_prediction_batch call off the event loop.
+
+Run with: python -m Lindel.Server --port 8080
+'''
+import argparse
+import asyncio
+import collections
+import json
+import time
+
+import numpy as np
+
+from .Model import load_model
+from .Engine import build_result
+from .Predictor import validate_sequence, gen_prediction_batch, class_table
+
+MAX_BATCH_SEQUENCES = 100
+MAX_BODY = 1 << 20
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+            411: 'Length Required', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class ServerMetrics:
+    """Request, sequence and batch counters with a window of recent request latencies."""
+
+    def __init__(self, window: int = 10000):
+        self.started = time.perf_counter()
+        self.requests = collections.Counter()
+        self.errors = 0
+        self.sequences = 0
+        self.batches = 0
+        self.batch_seconds = 0.0
+        self.latencies = collections.deque(maxlen=window)
+
+    def record_request(self, path: str, seconds: float, status: int):
+        self.requests[path] += 1
+        if status >= 400:
+            self.errors += 1
+        self.latencies.append(seconds)
+
+    def record_batch(self, size: int, seconds: float):
+        self.batches += 1
+        self.sequences += size
+        self.batch_seconds += seconds
+
+    def snapshot(self) -> dict:
+        uptime = time.perf_counter() - self.started
+        latencies = np.array(self.latencies) * 1000
+        pct = np.percentile(latencies, [50, 90, 99]) if len(latencies) else [0.0] * 3
+        return {
+            'uptime_s': round(uptime, 3),
+            'requests': dict(self.requests),
+            'errors': self.errors,
+            'sequences': self.sequences,
+            'batches': self.batches,
+            'mean_batch_size': round(self.sequences / self.batches, 2) if self.batches else 0.0,
+            'sequences_per_s': round(self.sequences / uptime, 2) if uptime else 0.0,
+            'model_sequences_per_s': round(self.sequences / self.batch_seconds, 2) if self.batch_seconds else 0.0,
+            'latency_ms': {'mean': round(float(latencies.mean()), 3) if len(latencies) else 0.0,
+                           'p50': round(float(pct[0]), 3), 'p90': round(float(pct[1]), 3),
+                           'p99': round(float(pct[2]), 3), 'window': len(latencies)},
+        }
+
+
+class MicroBatcher:
+    """
+    Coalesce single-sequence predictions into batches.
+
+    predict() queues a validated 60bp sequence and awaits its (y_hat, frameshift).
+    A background task takes up to max_batch queued sequences, waiting at most
+    max_wait seconds after the first for the batch to fill, and predicts them in
+    one gen_prediction_batch call in the default executor.
+    """
+
+    def __init__(self, wb, prereq, max_batch: int = 64, max_wait: float = 0.005, metrics: ServerMetrics = None):
+        self.wb = wb
+        self.prereq = prereq
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.metrics = metrics or ServerMetrics()
+        self._queue = None
+        self._task = None
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def predict(self, sequence: str):
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((sequence, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            seqs = [seq for seq, _ in batch]
+            start = time.perf_counter()
+            try:
+                y_hat, fs = await loop.run_in_executor(None, gen_prediction_batch, seqs, self.wb, self.prereq)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.metrics.record_batch(len(batch), time.perf_counter() - start)
+            for k, (_, future) in enumerate(batch):
+                if not future.done():
+                    future.set_result((y_hat[k], float(fs[k])))
+
+
+class PredictionServer:
+    """
+    HTTP front end of a MicroBatcher.
+
+    Responses for a sequence hold its frameshift ratio and the top_n outcomes as
+    {'label', 'frequency' (percent), 'type', 'size'}; invalid sequences give the
+    same error messages as Lindel_prediction.py.
+    """
+
+    def __init__(self, wb=None, prereq=None, host: str = '127.0.0.1', port: int = 8080, max_batch: int = 64,
+                 max_wait: float = 0.005, top_n: int = 20):
+        if wb is None or prereq is None:
+            wb, prereq = load_model()
+        self.wb = wb
+        self.prereq = prereq
+        self.host = host
+        self.port = port
+        self.top_n = top_n
+        self.classes = class_table(prereq[1])
+        self.metrics = ServerMetrics()
+        self.batcher = MicroBatcher(wb, prereq, max_batch, max_wait, self.metrics)
+        self._server = None
+
+    async def start(self):
+        '''Start listening; with port 0 the bound port is stored in self.port'''
+        self.batcher.start()
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        await self.batcher.stop()
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.stop()
+
+    async def predict_sequence(self, sequence, top_n: int = None) -> dict:
+        '''Validate and predict one sequence through the micro-batcher'''
+        if not isinstance(sequence, str):
+            return {'error': 'Sequence must be a string', 'sequence': sequence}
+        is_valid, result = validate_sequence(sequence)
+        if not is_valid:
+            return {'error': result, 'sequence': sequence}
+        y_hat, fs = await self.batcher.predict(result)
+        return self._build_result(result, y_hat, fs, self.top_n if top_n is None else top_n)
+
+    def _build_result(self, sequence: str, y_hat, fs: float, top_n: int) -> dict:
+        return build_result(self.classes, sequence, y_hat, fs, top_n)
+
+    async def _route(self, method: str, path: str, body: bytes):
+        if path == '/health':
+            return {'status': 'ok'}
+        if path == '/metrics':
+            return self.metrics.snapshot()
+        if path not in ('/predict', '/predict/batch'):
+            raise HTTPError(404, f'Unknown path: {path}')
+        if method != 'POST':
+            raise HTTPError(405, f'{path} requires POST')
+        try:
+            payload = json.loads(body or b'{}')
+        except ValueError:
+            raise HTTPError(400, 'Request body must be JSON')
+        if not isinstance(payload, dict):
+            raise HTTPError(400, 'Request body must be a JSON object')
+        top_n = payload.get('top_n', self.top_n)
+        if not isinstance(top_n, int) or isinstance(top_n, bool) or top_n < 1:
+            raise HTTPError(400, 'top_n must be a positive integer')
+        if path == '/predict':
+            if 'sequence' not in payload:
+                raise HTTPError(400, 'Missing "sequence"')
+            result = await self.predict_sequence(payload['sequence'], top_n)
+            if 'error' in result:
+                raise HTTPError(400, result['error'])
+            return result
+        sequences = payload.get('sequences')
+        if not isinstance(sequences, list) or not sequences:
+            raise HTTPError(400, 'Missing "sequences" list')
+        if len(sequences) > MAX_BATCH_SEQUENCES:
+            raise HTTPError(413, f'At most {MAX_BATCH_SEQUENCES} sequences per request')
+        results = await asyncio.gather(*(self.predict_sequence(seq, top_n) for seq in sequences))
+        return {'results': results}
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                start = time.perf_counter()
+                status, response, keep_alive = 200, None, True
+                path, body_read = '', False
+                try:
+                    request_line = await _readline(reader)
+                    if not request_line:
+                        break
+                    start = time.perf_counter()
+                    method, path, version = _parse_request_line(request_line)
+                    headers = await _read_headers(reader)
+                    keep_alive = (headers.get('connection', '').lower() != 'close' and
+                                  (version != 'HTTP/1.0' or headers.get('connection', '').lower() == 'keep-alive'))
+                    body = await _read_body(reader, headers)
+                    body_read = True
+                    response = await self._route(method, path.split('?', 1)[0], body)
+                except HTTPError as e:
+                    # before the body is read the rest of the request is still in the stream
+                    status, response, keep_alive = e.status, {'error': str(e)}, keep_alive and body_read
+                except Exception as e:
+                    status, response, keep_alive = 500, {'error': f'Prediction failed: {e}'}, False
+                _write_response(writer, status, response, keep_alive)
+                await writer.drain()
+                self.metrics.record_request(path.split('?', 1)[0], time.perf_counter() - start, status)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def _readline(reader) -> bytes:
+    try:
+        return await reader.readline()
+    except (ValueError, asyncio.LimitOverrunError):
+        raise HTTPError(400, 'Request line or header too long')
+
+
+def _parse_request_line(line: bytes):
+    parts = line.decode('latin-1').split()
+    if len(parts) != 3 or not parts[2].startswith('HTTP/'):
+        raise HTTPError(400, 'Malformed request line')
+    return parts[0].upper(), parts[1], parts[2]
+
+
+async def _read_headers(reader) -> dict:
+    headers = {}
+    while True:
+        line = await _readline(reader)
+        if line in (b'\r\n', b'\n', b''):
+            return headers
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+
+async def _read_body(reader, headers: dict) -> bytes:
+    if 'transfer-encoding' in headers:
+        raise HTTPError(411, 'Chunked request bodies are not supported; send Content-Length')
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise HTTPError(400, 'Invalid Content-Length')
+    if length > MAX_BODY:
+        raise HTTPError(413, f'Request body larger than {MAX_BODY} bytes')
+    return await reader.readexactly(length) if length > 0 else b''
+
+
+def _write_response(writer, status: int, payload, keep_alive: bool = True):
+    body = json.dumps(payload).encode()
+    writer.write((f'HTTP/1.1 {status} {_REASONS.get(status, "")}\r\n'
+                  f'Content-Type: application/json\r\n'
+                  f'Content-Length: {len(body)}\r\n'
+                  f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n').encode() + body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve Lindel predictions over HTTP')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on (default: 8080)')
+    parser.add_argument('--max-batch', type=int, default=64,
+                        help='Maximum number of sequences predicted together (default: 64)')
+    parser.add_argument('--max-wait-ms', type=float, default=5.0,
+                        help='Maximum time to wait for a micro-batch to fill, in ms (default: 5)')
+    parser.add_argument('--top', type=int, default=20, help='Default number of top outcomes (default: 20)')
+    args = parser.parse_args()
+
+    server = PredictionServer(host=args.host, port=args.port, max_batch=max(1, args.max_batch),
+                              max_wait=max(0.0, args.max_wait_ms) / 1000, top_n=args.top)
+
+    async def run():
+        await server.start()
+        print(f"Serving Lindel predictions on http://{server.host}:{server.port}")
+        await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+'''Scoring of single-base substitutions of a target (saturation / variant-effect scans).
+
+A substitution at position p only changes the candidate deletions whose duplicate
+test or microhomology comparisons involve base p, the microhomology features of
+those deletions, and the one-hot inputs covering p. score_variants therefore
+labels the reference once, patches only the affected comparisons per variant, and
+updates the reference logits of each head by adding and removing the weight rows
+of the inputs that changed, instead of predicting every variant from scratch.
+'''
+import functools
+
+import numpy as np
+
+from .Predictor import (_sparse, encode_sequences, indel_template, _collapse_deletions, _cached_table, _feature_table,
+                        sparse_inputs_batch, onehot_indices, _softmax_rows, gen_merge_index_batch, merge_classes)
+
+BASES = 'ATCG'
+PAM_POSITIONS = (34, 35)
+
+
+def all_substitutions(seq: str) -> list:
+    '''Every single-base substitution of seq as (position, base), 3 per position'''
+    return [(p, b) for p, ref in enumerate(seq.upper()) for b in BASES if b != ref]
+
+
+@functools.lru_cache(maxsize=None)
+def _position_index(seq_len: int = 60):
+    '''For each sequence position, the candidate deletions whose duplicate test compares it
+       and the (candidate, offset) microhomology comparisons involving it'''
+    t = indel_template(seq_len, 30)
+    link = [np.flatnonzero((t.start == p) | (t.start + t.length == p)) for p in range(seq_len)]
+    mh = [np.nonzero(((t.mh_left == p) | (t.mh_right == p)) & t.mh_valid) for p in range(seq_len)]
+    return link, mh
+
+
+def _offsets(index, pos):
+    '''Concatenate the per-position index arrays of pos, with the variant number of each entry'''
+    sizes = np.array([len(index[p]) for p in pos], dtype=np.intp)
+    rows = np.repeat(np.arange(len(pos)), sizes)
+    return rows, (np.concatenate([index[p] for p in pos]) if len(pos) else np.zeros(0, dtype=np.intp))
+
+
+def score_variants(seq: str, wb, prereq, variants=None) -> dict:
+    '''Predict the effect of single-base substitutions of a 60bp target.
+
+       variants is a list of (position, base) pairs, positions 0-based in seq (default:
+       all_substitutions(seq)). Returns a dict with the reference prediction ('y_hat',
+       'frameshift'), and per variant: 'variants', 'valid' (False when the substitution
+       breaks the NGG PAM; such variants have NaN predictions), 'y_hat', 'frameshift' and
+       their differences from the reference, 'delta_y_hat' and 'delta_frameshift'.
+    '''
+    w1, b1, w2, b2, w3, b3 = wb
+    label, rev_index, features, frame_shift = prereq
+    variants = all_substitutions(seq) if variants is None else list(variants)
+    ref = encode_sequences([seq.upper()])
+    if ref.shape[1] != 60:
+        raise ValueError(f"Target must be 60bp, got {ref.shape[1]}bp.")
+    if (ref[0, 34:36] != 3).any():
+        raise ValueError('Error: No PAM sequence is identified.')
+    pos = np.array([p for p, _ in variants], dtype=np.intp)
+    alt = encode_sequences([b.upper() for _, b in variants]).reshape(-1) if variants else np.zeros(0, np.uint8)
+    if ((pos < 0) | (pos >= 60)).any():
+        raise ValueError('Variant positions must be within the 60bp target.')
+
+    t = indel_template()
+    n_ft = len(features)
+    table, ins_cols = _cached_table('features', features, _feature_table)
+
+    # reference: indel labelling, active inputs and logits of the three heads
+    keep_ref, mh_ref, _ = _collapse_deletions(ref, t)
+    x_indel, x_del, x_ins = sparse_inputs_batch(ref, features, keep_ref, mh_ref)
+    logit_ratio, logit_del, logit_ins = x_indel @ w1 + b1, x_del @ w2 + b2, x_ins @ w3 + b3
+    y_ref = _combine(logit_ratio, logit_del, logit_ins, label, keep_ref, mh_ref)
+    fs_ref = float(y_ref[0] @ frame_shift)
+
+    valid = ~np.isin(pos, PAM_POSITIONS) | (alt == 3)
+    n = len(variants)
+    y_hat = np.full((n, len(frame_shift)), np.nan)
+    fs = np.full(n, np.nan)
+    if valid.any():
+        vpos, valt = pos[valid], alt[valid]
+        codes = np.repeat(ref, len(vpos), axis=0)
+        codes[np.arange(len(vpos)), vpos] = valt
+        keep, mh = _patch_labels(ref, codes, vpos, keep_ref, mh_ref, t)
+
+        # deletion head: microhomology features switched on or off by the changed deletions
+        # (a column can be set by more than one deletion, so count its setters)
+        ref_cols = _feature_cols(table, np.arange(len(t.start)), keep_ref[0], mh_ref[0])
+        ft_count = np.bincount(np.concatenate((ref_cols[ref_cols >= 0], ins_cols)), minlength=n_ft)
+        rows, cand = np.nonzero((keep != keep_ref) | ((mh != mh_ref) & (keep | keep_ref)))
+        old = _feature_cols(table, cand, keep_ref[0, cand], mh_ref[0, cand])
+        new = _feature_cols(table, cand, keep[rows, cand], mh[rows, cand])
+        key = np.concatenate((rows * n_ft + old, rows * n_ft + new))
+        step = np.concatenate((np.full(len(old), -1), np.ones(len(new), dtype=np.intp)))
+        found = np.concatenate((old, new)) >= 0
+        key, inverse = np.unique(key[found], return_inverse=True)
+        count = np.zeros(len(key), dtype=np.intp)
+        np.add.at(count, inverse, step[found])
+        d_rows, d_cols = key // n_ft, key % n_ft
+        d_sign = (ft_count[d_cols] + count > 0).astype(np.intp) - (ft_count[d_cols] > 0)
+        changed = d_sign != 0
+
+        # one-hot inputs of the guide (ratio and deletion heads) and of its last 6bp (insertion head)
+        g_rows, g_cols, g_sign = _onehot_changes(ref[:, 13:33], codes[:, 13:33])
+        i_rows, i_cols, i_sign = _onehot_changes(ref[:, 27:33], codes[:, 27:33])
+        ratio_logits = logit_ratio + _row_sums(g_rows, g_cols, g_sign, w1, len(vpos))
+        del_logits = logit_del + _row_sums(np.concatenate((d_rows[changed], g_rows)),
+                                           np.concatenate((d_cols[changed], g_cols + n_ft)),
+                                           np.concatenate((d_sign[changed], g_sign)), w2, len(vpos))
+        ins_logits = logit_ins + _row_sums(i_rows, i_cols, i_sign, w3, len(vpos))
+
+        y_hat[valid] = _combine(ratio_logits, del_logits, ins_logits, label, keep, mh)
+        fs[valid] = y_hat[valid] @ frame_shift
+
+    return {'sequence': seq.upper()[:60], 'y_hat': y_ref[0], 'frameshift': fs_ref,
+            'variants': variants, 'valid': valid, 'y_hat_variants': y_hat, 'frameshift_variants': fs,
+            'delta_y_hat': y_hat - y_ref, 'delta_frameshift': fs - fs_ref}
+
+
+def _patch_labels(ref, codes, pos, keep_ref, mh_ref, t):
+    '''Duplicate-collapsing and microhomology labels of the variants, recomputing only the
+       comparisons involving each variant's position'''
+    link_index, mh_index = _position_index(ref.shape[1])
+    n = len(codes)
+
+    linked_next = np.repeat((ref[:, t.start] == ref[:, t.start + t.length]) & (t.next >= 0), n, axis=0)
+    rows, cand = _offsets(link_index, pos)
+    linked_next[rows, cand] = (codes[rows, t.start[cand]] == codes[rows, t.start[cand] + t.length[cand]]) & \
+                              (t.next[cand] >= 0)
+    linked_prev = np.zeros_like(linked_next)
+    has_prev = t.prev >= 0
+    linked_prev[:, has_prev] = linked_next[:, t.prev[has_prev]]
+    keep = np.where(t.start <= 30, ~(linked_next & (t.start < 30)), ~linked_prev)
+
+    mh = np.repeat(mh_ref, n, axis=0)
+    sizes = [len(mh_index[p][0]) for p in pos]
+    rows = np.repeat(np.arange(n), sizes)
+    if len(rows):
+        cand = np.concatenate([mh_index[p][0] for p in pos])
+        j = np.concatenate([mh_index[p][1] for p in pos])
+        matches = np.repeat(((ref[:, t.mh_left] == ref[:, t.mh_right]) & t.mh_valid), n, axis=0)
+        matches[rows, cand, j] = codes[rows, t.mh_left[cand, j]] == codes[rows, t.mh_right[cand, j]]
+        mh[rows, cand] = np.cumprod(matches[rows, cand], axis=1, dtype=np.int8).sum(axis=1, dtype=np.int8)
+    return keep, mh
+
+
+def _feature_cols(table, cand, keep, mh):
+    '''Feature column set by each candidate deletion, -1 if it is not kept or has no feature'''
+    return np.where(keep, table[cand, mh], -1)
+
+
+def _onehot_changes(ref_codes, codes):
+    '''One-hot columns switched on (+1) and off (-1) in each variant, as (rows, cols, sign)'''
+    idx_ref = onehot_indices(ref_codes)[0]
+    idx = onehot_indices(codes)
+    rows, k = np.nonzero(idx != idx_ref)
+    return (np.concatenate((rows, rows)), np.concatenate((idx[rows, k], idx_ref[k])),
+            np.concatenate((np.ones(len(rows), dtype=np.intp), np.full(len(rows), -1))))
+
+
+def _row_sums(rows, cols, sign, w, n):
+    '''Signed sums of weight rows per variant: an (n, w.shape[1]) logit update'''
+    change = _sparse().csr_matrix((sign.astype(w.dtype), (rows, cols)), shape=(n, w.shape[0]))
+    return change @ w
+
+
+def _combine(ratio_logits, del_logits, ins_logits, label, keep, mh):
+    ratios = _softmax_rows(ratio_logits)
+    y_hat = np.hstack((_softmax_rows(del_logits) * ratios[:, :1], _softmax_rows(ins_logits) * ratios[:, 1:2]))
+    return merge_classes(y_hat, gen_merge_index_batch(label, keep, mh))
+
+
+VARIANT_COLUMNS = ['Position', 'Ref', 'Alt', 'Frameshift_Ratio', 'Delta_Frameshift', 'Top_Outcome', 'Top_Frequency',
+                   'Max_Change_Outcome', 'Max_Change']
+
+
+def variant_rows(result: dict, rev_index) -> list:
+    '''Rows of VARIANT_COLUMNS for a score_variants result: the top outcome of each variant and
+       the outcome whose probability changed most (frequencies and changes in percent)'''
+    rows = []
+    seq = result['sequence']
+    for k, (p, alt) in enumerate(result['variants']):
+        if not result['valid'][k]:
+            rows.append([p, seq[p], alt.upper(), 'NA', 'NA', 'NA', 'NA', 'NA', 'NA'])
+            continue
+        y, delta = result['y_hat_variants'][k], result['delta_y_hat'][k]
+        top, moved = int(np.argmax(y)), int(np.argmax(np.abs(delta)))
+        rows.append([p, seq[p], alt.upper(), f"{result['frameshift_variants'][k]:.4f}",
+                     f"{result['delta_frameshift'][k]:+.4f}", rev_index[top], f"{y[top] * 100:.2f}",
+                     rev_index[moved], f"{delta[moved] * 100:+.2f}"])
+    return rows
+
+
+def write_variants_tsv(result: dict, rev_index, output_file: str) -> int:
+    '''Write a score_variants result as TSV, returns the number of variants written'''
+    rows = variant_rows(result, rev_index)
+    with open(output_file, 'w') as f:
+        f.write('\t'.join(VARIANT_COLUMNS) + '\n')
+        for row in rows:
+            f.write('\t'.join(map(str, row)) + '\n')
+    return len(rows)
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+Lindel Benchmark Script
+
+Measures the throughput and peak memory of the prediction hot paths on synthetic
+60bp targets (random bases with an NGG PAM at positions 33-36, generated from a
+fixed seed so every run scores the same sequences).
+
+Stages:
+    per-sequence:  gen_indel, label_mh, onehotencoder, create_feature_array,
+                   gen_cmatrix, gen_prediction
+    batched:       encode_sequences, gen_indel_batch, onehotencoder_batch,
+                   create_feature_array_batch, predict_heads, predict_heads_sparse,
+                   merge_classes, gen_prediction_batch, gen_frameshift_batch
+    end-to-end:    process_batch_file (TSV output, no visual alignments),
+                   predict_many_serial and predict_many_threads (Lindel.Engine
+                   LindelPredictor.predict_many in the calling thread and on a pool
+                   of --threads threads)
+
+Batched stages run over the input in chunks of --chunk-size sequences, like
+process_batch_file does. Per-sequence stages are slow by design and are measured
+on at most --max-per-sequence sequences of each size; the number of sequences
+actually measured is part of every result.
+
+Usage:
+    python Lindel_benchmark.py                              # sizes 1, 1000, 100000
+    python Lindel_benchmark.py --sizes 1000 --stages gen_prediction_batch process_batch_file
+    python Lindel_benchmark.py -o bench.json                # machine-readable results
+    python Lindel_benchmark.py --compare bench.json         # report changes against a saved run
+
+Results (JSON) hold, per stage and size: sequences measured, best wall time over
+--repeat runs, sequences per second and the peak traced memory (tracemalloc, in a
+separate run so tracing does not distort the timings).
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, current_dir)
+
+from Lindel.Predictor import (gen_indel, label_mh, onehotencoder, create_feature_array, gen_cmatrix, gen_prediction,
+                              encode_sequences, gen_indel_batch, onehotencoder_batch, create_feature_array_batch,
+                              _predict_heads, gen_merge_index_batch, merge_classes, gen_prediction_batch,
+                              gen_frameshift_batch)
+from Lindel.Model import load_model
+from Lindel.Engine import LindelPredictor
+
+DEFAULT_SIZES = [1, 1000, 100000]
+DEFAULT_SEED = 0
+
+
+def synthetic_targets(n: int, seed: int = DEFAULT_SEED) -> list:
+    '''n random 60bp targets with an NGG PAM at positions 33-36, identical for a given seed'''
+    codes = np.random.default_rng(seed).integers(0, 4, size=(n, 60), dtype=np.uint8)
+    codes[:, 34:36] = 3
+    raw = np.frombuffer(b'ATCG', dtype=np.uint8)[codes]
+    return [row.tobytes().decode() for row in raw]
+
+
+def _each(func):
+    def run(items):
+        for item in items:
+            func(item)
+    return run
+
+
+def build_stages(wb, prereq, threads: int = None):
+    '''Benchmark stages: name -> (kind, prepare, run). prepare turns a list of sequences into
+       the input of run and is not timed; batched stages are prepared and run per chunk'''
+    label, rev_index, features, frame_shift = prereq
+    engine = []
+
+    def predictor(seqs):
+        if not engine:
+            engine.append(LindelPredictor(threads=threads, wb=wb, prereq=prereq))
+        return list(seqs)
+
+    def indels(seqs):
+        return [gen_indel(seq, 30) for seq in seqs]
+
+    def labelled(seqs):
+        return gen_indel_batch(encode_sequences(seqs), 30)
+
+    def heads(seqs):
+        ratios, ds, ins, keep, mh = _predict_heads(encode_sequences(seqs), wb, prereq)
+        return np.hstack((ds * ratios[:, :1], ins * ratios[:, 1:2])), keep, mh
+
+    return {
+        'gen_indel': ('per_sequence', list, _each(lambda seq: gen_indel(seq, 30))),
+        'label_mh': ('per_sequence', indels, _each(lambda ind: label_mh(ind, 4))),
+        'onehotencoder': ('per_sequence', list, _each(lambda seq: onehotencoder(seq[13:33]))),
+        'create_feature_array': ('per_sequence', indels, _each(lambda ind: create_feature_array(features, ind))),
+        'gen_cmatrix': ('per_sequence', indels, _each(lambda ind: gen_cmatrix(ind, label))),
+        'gen_prediction': ('per_sequence', list, _each(lambda seq: gen_prediction(seq, wb, prereq))),
+        'encode_sequences': ('batched', list, encode_sequences),
+        'gen_indel_batch': ('batched', encode_sequences, lambda c: gen_indel_batch(c, 30)),
+        'onehotencoder_batch': ('batched', encode_sequences, lambda c: onehotencoder_batch(c[:, 13:33])),
+        'create_feature_array_batch': ('batched', labelled, lambda km: create_feature_array_batch(features, *km)),
+        'predict_heads': ('batched', encode_sequences, lambda c: _predict_heads(c, wb, prereq)),
+        'predict_heads_sparse': ('batched', encode_sequences, lambda c: _predict_heads(c, wb, prereq, sparse_inputs=True)),
+        'merge_classes': ('batched', heads, lambda h: merge_classes(h[0], gen_merge_index_batch(label, h[1], h[2]))),
+        'gen_prediction_batch': ('batched', list, lambda s: gen_prediction_batch(s, wb, prereq)),
+        'gen_frameshift_batch': ('batched', list, lambda s: gen_frameshift_batch(s, wb, prereq)),
+        'process_batch_file': ('end_to_end', _prepare_batch_file, _process_batch_file),
+        'predict_many_serial': ('end_to_end', predictor, lambda s, _: engine[0].predict_many(s, parallel=False)),
+        'predict_many_threads': ('end_to_end', predictor, lambda s, _: engine[0].predict_many(s)),
+    }
+
+
+def _prepare_batch_file(seqs):
+    '''Write seqs as a batch input file (and load the predictor once, outside the timings)'''
+    if _process_batch_file.predictor is None:
+        from Lindel_prediction import LindelBatchPredictor
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            _process_batch_file.predictor = LindelBatchPredictor(verbose=False)
+    fd, path = tempfile.mkstemp(prefix='lindel_bench_', suffix='.txt')
+    with os.fdopen(fd, 'w') as f:
+        f.writelines(f"{seq}\tseq_{i}\n" for i, seq in enumerate(seqs))
+    return path
+
+
+def _process_batch_file(path, chunk_size: int = 1000):
+    out = path + '.tsv'
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            _process_batch_file.predictor.process_batch_file(path, out, 'tsv', 20, chunk_size, visual=False)
+    finally:
+        for name in (path, out):
+            if os.path.exists(name):
+                os.remove(name)
+_process_batch_file.predictor = None
+
+
+def _run_stage(stage, seqs, chunk_size: int, trace: bool = False):
+    '''Time one pass of a stage over seqs (excluding prepare); with trace, also return the
+       largest tracemalloc peak above the memory in use before each run'''
+    kind, prepare, run = stage
+    step = chunk_size if kind == 'batched' else max(1, len(seqs))
+    elapsed, peak = 0.0, 0
+    for start in range(0, len(seqs), step):
+        data = prepare(seqs[start:start + step])
+        if trace:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        t0 = time.perf_counter()
+        if kind == 'end_to_end':
+            run(data, chunk_size)
+        else:
+            run(data)
+        elapsed += time.perf_counter() - t0
+        if trace:
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+        del data
+    return elapsed, peak
+
+
+def measure(stage, seqs, chunk_size: int = 1000, repeat: int = 3, memory: bool = True) -> dict:
+    '''Best-of-repeat wall time, throughput and (optionally) peak traced memory of one stage'''
+    times = [_run_stage(stage, seqs, chunk_size)[0] for _ in range(max(1, repeat))]
+    best = min(times)
+    result = {'kind': stage[0], 'n': len(seqs), 'seconds': best, 'mean_seconds': sum(times) / len(times),
+              'sequences_per_s': len(seqs) / best if best > 0 else None}
+    if memory:
+        tracemalloc.start()
+        try:
+            result['peak_mb'] = _run_stage(stage, seqs, chunk_size, trace=True)[1] / 2 ** 20
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, stages=None, seed: int = DEFAULT_SEED, chunk_size: int = 1000,
+                   repeat: int = 3, max_per_sequence: int = 1000, memory: bool = True, log=None,
+                   threads: int = None) -> dict:
+    '''Run the selected stages (default: all) at every size, returns the JSON-serializable report'''
+    wb, prereq = load_model()
+    threads = threads or os.cpu_count() or 1
+    available = build_stages(wb, prereq, threads)
+    names = stages or list(available)
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise ValueError(f"Unknown stage(s): {', '.join(unknown)}. Available: {', '.join(available)}")
+
+    results = []
+    for size in sizes:
+        seqs = synthetic_targets(size, seed)
+        for name in names:
+            stage = available[name]
+            n = min(size, max_per_sequence) if stage[0] == 'per_sequence' else size
+            # Slow single-process runs of large inputs are not worth repeating
+            reps = repeat if n <= 10000 else 1
+            result = {'stage': name, 'size': size, **measure(stage, seqs[:n], chunk_size, reps, memory)}
+            results.append(result)
+            if log:
+                log(result)
+
+    return {
+        'meta': {
+            'seed': seed,
+            'chunk_size': chunk_size,
+            'repeat': repeat,
+            'max_per_sequence': max_per_sequence,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'threads': threads,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+
+
+def compare(report: dict, baseline: dict, threshold: float = 0.1) -> list:
+    '''Throughput change of each (stage, size) present in both reports; rows slower than
+       baseline by more than threshold are flagged as regressions'''
+    base = {(r['stage'], r['size']): r for r in baseline['results']}
+    rows = []
+    for r in report['results']:
+        b = base.get((r['stage'], r['size']))
+        if b is None or not b.get('sequences_per_s') or not r.get('sequences_per_s') or b['n'] != r['n']:
+            continue
+        ratio = r['sequences_per_s'] / b['sequences_per_s']
+        rows.append({'stage': r['stage'], 'size': r['size'], 'baseline_per_s': b['sequences_per_s'],
+                     'sequences_per_s': r['sequences_per_s'], 'ratio': ratio, 'regression': ratio < 1 - threshold})
+    return rows
+
+
+def _format_result(r: dict) -> str:
+    rate = f"{r['sequences_per_s']:>12,.0f}/s" if r['sequences_per_s'] else f"{'-':>14}"
+    peak = f"{r['peak_mb']:>9.1f} MB" if 'peak_mb' in r else ''
+    return f"{r['stage']:<28}{r['size']:>8}{r['n']:>8}{r['seconds'] * 1000:>12.2f} ms{rate}{peak}"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the Lindel prediction stages on synthetic targets',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__
+    )
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='Numbers of sequences (default: 1 1000 100000)')
+    parser.add_argument('--stages', nargs='+', help='Stages to run (default: all)')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help='Seed of the synthetic targets (default: 0)')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='Sequences per batched call (default: 1000)')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per stage, best is kept (default: 3)')
+    parser.add_argument('--max-per-sequence', type=int, default=1000,
+                        help='Cap on sequences for per-sequence stages (default: 1000)')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='Thread pool size of predict_many_threads (default: number of CPUs)')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the peak memory measurement')
+    parser.add_argument('-o', '--output', help='Write the results as JSON to this file')
+    parser.add_argument('--compare', help='Compare throughput against a previous JSON result file')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Relative slowdown reported as a regression with --compare (default: 0.1)')
+    args = parser.parse_args()
+
+    print(f"{'Stage':<28}{'Size':>8}{'N':>8}{'Time':>15}{'Throughput':>14}{'Peak':>12}")
+    try:
+        report = run_benchmarks(args.sizes, args.stages, args.seed, max(1, args.chunk_size), args.repeat,
+                                args.max_per_sequence, not args.no_memory,
+                                log=lambda r: print(_format_result(r), flush=True), threads=args.threads)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to: {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        rows = compare(report, baseline, args.threshold)
+        print(f"\nCompared with {args.compare}:")
+        for row in rows:
+            flag = '  REGRESSION' if row['regression'] else ''
+            print(f"{row['stage']:<28}{row['size']:>8}{row['ratio']:>10.2f}x{flag}")
+        if any(row['regression'] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -30,20 +30,35 @@ Requirements:
 """
 
 import argparse
+import contextlib
+import csv
+import gzip
+import io
+import itertools
+import multiprocessing
 import sys
 import os
 import json
-import pickle as pkl
 import re
-from typing import List, Dict, Tuple, Optional
+import textwrap
+import time
+import numpy as np
+from typing import List, Dict, Tuple, Optional, Iterable, Iterator
 
 # Add the current directory to Python path to import Lindel
 current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, current_dir)
 
 try:
-    from Lindel.Predictor import gen_prediction
-    import Lindel
+    from Lindel.Predictor import validate_sequence, compare_precision, gen_prediction, gen_prediction_batch, gen_frameshift_batch, top_k_classes, class_table, open_input
+    from Lindel.Model import load_model
+    from Lindel.Cache import PredictionCache, gen_prediction_cached, model_version
+    from Lindel.Scanner import scan_fasta, write_scan_tsv
+    from Lindel.Evaluation import evaluate, EvaluationSummary, evaluation_rows, EVALUATION_COLUMNS
+    from Lindel.Aggregate import GroupAggregator, group_key, group_row, GROUP_BY, GROUP_COLUMNS
+    from Lindel.Variants import score_variants, variant_rows, write_variants_tsv, VARIANT_COLUMNS
+    from Lindel.Columnar import NpzPredictionWriter, ParquetPredictionWriter
+    from Lindel.Profile import PROFILER, enable_profiling, profiling_enabled, profile_stage
 except ImportError as e:
     print(f"Error: Could not import Lindel module: {e}")
     print("Make sure the Lindel folder is in the same directory as this script.")
@@ -52,28 +67,64 @@ except ImportError as e:
     print(f"Exists: {os.path.exists(os.path.join(current_dir, 'Lindel'))}")
     sys.exit(1)
 
+# Number of sequences scored per call to gen_prediction_batch
+DEFAULT_CHUNK_SIZE = 1000
+
+# Suffix of the progress file of resumable batch jobs
+CHECKPOINT_SUFFIX = '.ckpt'
+
+
 class LindelBatchPredictor:
-    def __init__(self):
-        """Initialize the predictor by loading model weights and prerequisites."""
-        try:
-            # Load model weights and prerequisites
-            lindel_path = Lindel.__path__[0]
-            
-            with open(os.path.join(lindel_path, "Model_weights.pkl"), 'rb') as f:
-                self.weights = pkl.load(f)
-            
-            with open(os.path.join(lindel_path, 'model_prereq.pkl'), 'rb') as f:
-                self.prerequesites = pkl.load(f)
+    def __init__(self, verbose: bool = True, cache_size: int = 0, cache_db: Optional[str] = None,
+                 dtype: str = 'float64'):
+        """
+        Initialize the predictor. The model weights and prerequisites are loaded on
+        first use, so argument and input errors are reported without loading them.
+        
+        Args:
+            verbose: Report successful model loading
+            cache_size: Predictions kept in an in-memory LRU cache (0 disables caching)
+            cache_db: Optional SQLite file persisting cached predictions across runs
+            dtype: Floating point type of the batched model evaluation ('float64' or 'float32')
+        """
+        self.verbose = verbose
+        self.cache_size = cache_size
+        self.cache_db = cache_db
+        self.dtype = dtype
+        self._model = None
+        self._cache = None
+    
+    @property
+    def weights(self):
+        return self._load_model()[0]
+    
+    @property
+    def prerequesites(self):
+        return self._load_model()[1]
+    
+    @property
+    def cache(self) -> Optional[PredictionCache]:
+        if self._cache is None and (self.cache_size > 0 or self.cache_db):
+            self._cache = PredictionCache(self.cache_size, self.cache_db, model_version(self.weights, self.prerequesites))
+        return self._cache
+    
+    def _load_model(self) -> Tuple:
+        """Load the model weights and prerequisites on first use (cached once per process)."""
+        if self._model is None:
+            try:
+                self._model = load_model(dtype=self.dtype)
                 
-            print("Model loaded successfully.")
-            
-        except FileNotFoundError as e:
-            print(f"Error: Required model files not found: {e}")
-            print("Make sure Model_weights.pkl and model_prereq.pkl are in the Lindel folder.")
-            sys.exit(1)
-        except Exception as e:
-            print(f"Error loading model: {e}")
-            sys.exit(1)
+                if self.verbose:
+                    print("Model loaded successfully.")
+                
+            except FileNotFoundError as e:
+                print(f"Error: Required model files not found: {e}")
+                print("Make sure Model_weights.pkl and model_prereq.pkl are in the Lindel folder.")
+                sys.exit(1)
+            except Exception as e:
+                print(f"Error loading model: {e}")
+                sys.exit(1)
+        return self._model
     
     def validate_sequence(self, sequence: str) -> Tuple[bool, str]:
         """
@@ -86,32 +137,18 @@ class LindelBatchPredictor:
             Tuple of (is_valid, error_message)
         """
         sequence = sequence.upper().strip()
-        
-        if not re.match(r"^[ATCG]+$", sequence):
-            return False, "Invalid characters in sequence. Only A, T, C, G allowed."
-        
-        if len(sequence) < 60:
-            return False, f"Sequence too short: {len(sequence)}bp. Need at least 60bp."
-        
-        if len(sequence) > 60:
+        if len(sequence) > 60 and re.match(r"^[ATCG]+$", sequence):
             print(f"Warning: Sequence longer than 60bp ({len(sequence)}bp), using first 60bp.")
-            sequence = sequence[:60]
-
-        # Check for PAM sequence (any of AGG, TGG, CGG, GGG) at positions 33-36
-        pam_region = sequence[33:36]
-        valid_pams = ['AGG', 'TGG', 'CGG', 'GGG']
-        if pam_region not in valid_pams:
-            return False, f"No valid PAM sequence found at position 33-36. Found: {pam_region}"
-        
-        return True, sequence[:60]
+        return validate_sequence(sequence)
     
-    def predict_single(self, sequence: str, top_n: int = 20) -> Dict:
+    def predict_single(self, sequence: str, top_n: int = 20, visual: bool = True) -> Dict:
         """
         Predict indels for a single sequence.
         
         Args:
             sequence: 60bp DNA sequence
             top_n: Number of top predictions to return
+            visual: Include the visual alignment of each predicted outcome
             
         Returns:
             Dictionary with prediction results
@@ -123,100 +160,259 @@ class LindelBatchPredictor:
         sequence = result
         
         try:
-            y_hat, fs = gen_prediction(sequence, self.weights, self.prerequesites)
-            
-            rev_index = self.prerequesites[1]
-            pred_freq = {rev_index[i]: y_hat[i] for i in range(len(y_hat)) if y_hat[i] != 0}
-            pred_sorted = sorted(pred_freq.items(), key=lambda kv: kv[1], reverse=True)
+            if self.cache is not None:
+                y_hat, fs = gen_prediction_cached([sequence], self.weights, self.prerequesites, self.cache)
+                y_hat, fs = y_hat[0], fs[0]
+            else:
+                y_hat, fs = gen_prediction(sequence, self.weights, self.prerequesites)
+            return self._build_result(sequence, y_hat, fs, top_n, visual)
             
-            # Limit to top N predictions
-            pred_sorted = pred_sorted[:top_n]
+        except Exception as e:
+            return {"error": f"Prediction failed: {str(e)}", "sequence": sequence}
+    
+    def predict_batch(self, sequences: List[str], top_n: int = 20, visual: bool = True) -> List[Dict]:
+        """
+        Predict indels for many sequences with a single batched model evaluation.
+        
+        Args:
+            sequences: DNA sequences (validated individually)
+            top_n: Number of top predictions to return per sequence
+            visual: Include the visual alignment of each predicted outcome
             
-            predictions = self._format_predictions(sequence, pred_sorted)
+        Returns:
+            List of result dictionaries in input order, as from predict_single
+        """
+        results, valid_idx, valid_seqs = self._validate_batch(sequences)
+        
+        if valid_seqs:
+            try:
+                if self.cache is not None:
+                    y_hat, fs = gen_prediction_cached(valid_seqs, self.weights, self.prerequesites, self.cache)
+                else:
+                    y_hat, fs = gen_prediction_batch(valid_seqs, self.weights, self.prerequesites)
+            except Exception as e:
+                for i, sequence in zip(valid_idx, valid_seqs):
+                    results[i] = {"error": f"Prediction failed: {str(e)}", "sequence": sequence}
+            else:
+                with profile_stage('rank', len(valid_seqs)):
+                    top_idx, top_freq = top_k_classes(y_hat, top_n)
+                with profile_stage('format', len(valid_seqs)):
+                    for k, (i, sequence) in enumerate(zip(valid_idx, valid_seqs)):
+                        results[i] = self._build_top_result(sequence, top_idx[k], top_freq[k], fs[k], visual)
+        
+        return results
+    
+    def predict_frameshift_batch(self, sequences: List[str]) -> List[Dict]:
+        """
+        Predict only the frameshift, deletion and insertion ratios of many sequences,
+        skipping the outcome distribution, ranking and formatting.
+        
+        Args:
+            sequences: DNA sequences (validated individually)
             
-            return {
-                "sequence": sequence,
-                "frameshift_ratio": round(fs, 4),
-                "num_predictions": len(predictions),
-                "predictions": predictions
-            }
+        Returns:
+            List of result dictionaries in input order
+        """
+        results, valid_idx, valid_seqs = self._validate_batch(sequences)
+        
+        if valid_seqs:
+            try:
+                if self.cache is not None:
+                    y_hat, fs = gen_prediction_cached(valid_seqs, self.weights, self.prerequesites, self.cache)
+                    del_ratio = y_hat[:, :len(self.weights[3])].sum(axis=1)
+                    ins_ratio = 1 - del_ratio
+                else:
+                    fs, del_ratio, ins_ratio = gen_frameshift_batch(valid_seqs, self.weights, self.prerequesites,
+                                                                    return_ratios=True)
+            except Exception as e:
+                for i, sequence in zip(valid_idx, valid_seqs):
+                    results[i] = {"error": f"Prediction failed: {str(e)}", "sequence": sequence}
+            else:
+                for k, (i, sequence) in enumerate(zip(valid_idx, valid_seqs)):
+                    results[i] = {
+                        "sequence": sequence,
+                        "frameshift_ratio": round(float(fs[k]), 4),
+                        "deletion_ratio": round(float(del_ratio[k]), 4),
+                        "insertion_ratio": round(float(ins_ratio[k]), 4)
+                    }
+        
+        return results
+    
+    def predict_distribution_batch(self, sequences: List[str]) -> List[Dict]:
+        """
+        Predict the full outcome distribution of many sequences, unranked and unformatted.
+        
+        Args:
+            sequences: DNA sequences (validated individually)
             
-        except Exception as e:
-            return {"error": f"Prediction failed: {str(e)}", "sequence": sequence}
+        Returns:
+            List of result dictionaries in input order, holding the frameshift ratio and
+            the class probabilities ('y_hat', float32) of each valid sequence
+        """
+        results, valid_idx, valid_seqs = self._validate_batch(sequences)
+        
+        if valid_seqs:
+            try:
+                if self.cache is not None:
+                    y_hat, fs = gen_prediction_cached(valid_seqs, self.weights, self.prerequesites, self.cache)
+                else:
+                    y_hat, fs = gen_prediction_batch(valid_seqs, self.weights, self.prerequesites)
+            except Exception as e:
+                for i, sequence in zip(valid_idx, valid_seqs):
+                    results[i] = {"error": f"Prediction failed: {str(e)}", "sequence": sequence}
+            else:
+                y_hat = y_hat.astype(np.float32)
+                for k, (i, sequence) in enumerate(zip(valid_idx, valid_seqs)):
+                    results[i] = {"sequence": sequence, "frameshift_ratio": float(fs[k]), "y_hat": y_hat[k]}
+        
+        return results
+    
+    def _validate_batch(self, sequences: List[str]) -> Tuple[List[Optional[Dict]], List[int], List[str]]:
+        """
+        Validate a batch of sequences.
+        
+        Returns:
+            Tuple of (results with error entries filled in, indices of valid sequences, valid sequences)
+        """
+        results: List[Optional[Dict]] = [None] * len(sequences)
+        valid_idx = []
+        valid_seqs = []
+        with profile_stage('validate', len(sequences)):
+            for i, sequence in enumerate(sequences):
+                is_valid, result = self.validate_sequence(sequence)
+                if not is_valid:
+                    results[i] = {"error": result, "sequence": sequence}
+                else:
+                    valid_idx.append(i)
+                    valid_seqs.append(result)
+        return results, valid_idx, valid_seqs
     
-    def _format_predictions(self, seq: str, pred_sorted: List[Tuple]) -> List[Dict]:
-        """Format predictions into a readable format."""
+    def _build_result(self, sequence: str, y_hat, fs: float, top_n: int, visual: bool = True) -> Dict:
+        """Build the result dictionary for one predicted sequence."""
+        top_idx, top_freq = top_k_classes(y_hat, top_n)
+        return self._build_top_result(sequence, top_idx[0], top_freq[0], fs, visual)
+    
+    def _build_top_result(self, sequence: str, top_idx, top_freq, fs: float, visual: bool = True) -> Dict:
+        """Build the result dictionary from the top classes (from top_k_classes) of one sequence."""
+        predictions = self._format_predictions(sequence, top_idx[top_idx >= 0], top_freq[top_idx >= 0], visual)
+        
+        return {
+            "sequence": sequence,
+            "frameshift_ratio": round(float(fs), 4),
+            "num_predictions": len(predictions),
+            "predictions": predictions
+        }
+    
+    def _format_predictions(self, seq: str, classes, freqs, visual: bool = True) -> List[Dict]:
+        """
+        Format predictions into a readable format.
+        
+        Args:
+            seq: Predicted 60bp sequence
+            classes: Class indices, in decreasing order of frequency
+            freqs: Predicted frequency of each class
+            visual: Include the visual alignment of each outcome
+        """
+        table = class_table(self.prerequesites[1])
         predictions = []
         ss = 13
         cs = ss + 17
         
-        for pt, freq in pred_sorted:
-            try:
+        for c, freq in zip(classes.tolist(), freqs.tolist()):
+            if not table.is_insertion[c]:
                 # Deletion
-                idx1, dl = map(int, pt.split('+'))
-                indel_type = f"D{dl}"
-                position = idx1 - 30
+                dl = int(table.size[c])
+                position = int(table.start[c]) - 30
                 
-                # Create visual representation
-                idx1 += cs
-                idx2 = idx1 + dl
-                if idx1 < cs:
-                    if idx2 >= cs:
-                        visual = f"{seq[:idx1]}{'-' * (cs - idx1)} | {'-' * (idx2 - cs)}{seq[idx2:]}"
-                    else:
-                        visual = f"{seq[:idx1]}{'-' * (idx2 - idx1)}{seq[idx2:cs]} | {seq[cs:]}"
-                elif idx1 > cs:
-                    visual = f"{seq[:cs]} | {seq[cs:idx1]}{'-' * dl}{seq[idx2:]}"
-                else:
-                    visual = f"{seq[:idx1]} | {'-' * dl}{seq[idx2:]}"
-                    
-                predictions.append({
+                pred = {
                     "type": "deletion",
                     "size": dl,
                     "position": position,
                     "frequency": round(freq * 100, 3),
-                    "description": f"{indel_type} at position {position}",
-                    "visual": visual
-                })
+                    "description": f"D{dl} at position {position}",
+                }
                 
-            except ValueError:
-                # Insertion
-                idx1 = int(pt.split('+')[0])
-                if pt != '3':
-                    bp = pt.split('+')[1]
-                    size = len(bp)
-                    description = f"I{size}+{bp}"
-                else:
-                    bp = 'X'  # label any insertion >= 3bp as X
-                    size = "≥3"
-                    description = f"I3+{bp}"
+                if visual:
+                    # Create visual representation
+                    idx1 = int(table.start[c]) + cs
+                    idx2 = idx1 + dl
+                    if idx1 < cs:
+                        if idx2 >= cs:
+                            pred["visual"] = f"{seq[:idx1]}{'-' * (cs - idx1)} | {'-' * (idx2 - cs)}{seq[idx2:]}"
+                        else:
+                            pred["visual"] = f"{seq[:idx1]}{'-' * (idx2 - idx1)}{seq[idx2:cs]} | {seq[cs:]}"
+                    elif idx1 > cs:
+                        pred["visual"] = f"{seq[:cs]} | {seq[cs:idx1]}{'-' * dl}{seq[idx2:]}"
+                    else:
+                        pred["visual"] = f"{seq[:idx1]} | {'-' * dl}{seq[idx2:]}"
                 
-                visual = f"{seq[:cs]} {bp}{' ' * (2 - len(bp))}{seq[cs:]}"
+            else:
+                # Insertion ('X' labels any insertion >= 3bp)
+                bp = table.bases[c]
                 
-                predictions.append({
+                pred = {
                     "type": "insertion",
-                    "size": size,
+                    "size": len(bp) if bp != 'X' else "≥3",
                     "sequence": bp,
                     "frequency": round(freq * 100, 3),
-                    "description": description,
-                    "visual": visual
-                })
+                    "description": f"I{len(bp)}+{bp}" if bp != 'X' else f"I3+{bp}",
+                }
+                
+                if visual:
+                    pred["visual"] = f"{seq[:cs]} {bp}{' ' * (2 - len(bp))}{seq[cs:]}"
+            
+            predictions.append(pred)
         
         return predictions
     
-    def process_batch_file(self, input_file: str, output_file: str, output_format: str = 'tsv', top_n: int = 20):
+    def process_batch_file(self, input_file: str, output_file: str, output_format: str = 'tsv', top_n: int = 20,
+                           chunk_size: int = DEFAULT_CHUNK_SIZE, workers: int = 1, frameshift_only: bool = False,
+                           visual: bool = True, sparse_threshold: Optional[float] = None, resume: bool = False,
+                           verbose: bool = False):
         """
         Process batch sequences from a file.
         
         Args:
             input_file: Path to input file with sequences
             output_file: Path to output file
-            output_format: Output format ('tsv', 'json', 'csv')
+            output_format: Output format ('tsv', 'csv', 'json', 'jsonl', 'npz', 'parquet')
             top_n: Number of top predictions per sequence
+            chunk_size: Number of sequences scored per batched model evaluation
+            workers: Number of worker processes scoring chunks in parallel
+            frameshift_only: Only report frameshift, deletion and insertion ratios
+            visual: Include the visual alignment of each predicted outcome
+            sparse_threshold: For npz/parquet, store only class probabilities at or above this value
+            resume: Record progress in a checkpoint next to the output, and continue from an
+                existing checkpoint, appending to the output, instead of starting over
+            verbose: Report every sequence instead of one progress line per chunk
         """
+        if frameshift_only:
+            mode = 'frameshift'
+        elif output_format.lower() in COLUMNAR_FORMATS:
+            mode = 'distribution'
+        else:
+            mode = 'outcomes'
+        
+        checkpoint = state = None
+        if resume:
+            writer_class = RESULT_WRITERS.get(output_format.lower(), TsvResultWriter)
+            if not writer_class.resumable or output_file.endswith('.gz'):
+                print(f"Error: Resuming is not supported for {output_format} or gzipped output.")
+                return
+            try:
+                checkpoint = BatchCheckpoint(output_file, {
+                    **_input_fingerprint(input_file), 'format': output_format.lower(), 'top_n': top_n,
+                    'mode': mode, 'visual': visual, 'dtype': self.dtype})
+                state = checkpoint.load()
+            except (OSError, ValueError) as e:
+                print(f"Error: Cannot resume: {e}")
+                return
+            if state is not None and state.get('complete'):
+                print(f"Nothing to do: {output_file} is complete according to {checkpoint.path}")
+                return
+        
         try:
-            with open(input_file, 'r') as f:
-                lines = f.readlines()
+            infile = open_sequence_input(input_file)
         except FileNotFoundError:
             print(f"Error: Input file '{input_file}' not found.")
             return
@@ -224,110 +420,702 @@ class LindelBatchPredictor:
             print(f"Error reading input file: {e}")
             return
         
-        results = []
-        processed = 0
-        errors = 0
+        processed = state['processed'] if state else 0
+        errors = state['errors'] if state else 0
+        start_line = state['next_line'] if state else 0
+        started = time.perf_counter()
         
-        print(f"Processing {len(lines)} sequences...")
+        if state:
+            print(f"Resuming from input line {start_line + 1} ({processed + errors} sequences already done)")
+        print("Processing sequences...")
         
-        for i, line in enumerate(lines):
-            line = line.strip()
-            if not line:
-                continue
-            
-            # Parse line (sequence and optional name)
-            parts = line.split('\t')
-            sequence = parts[0].strip()
-            seq_name = parts[1].strip() if len(parts) > 1 else f"seq_{i+1}"
-            
-            print(f"Processing {i+1}/{len(lines)}: {seq_name}", end=" ... ")
+        try:
+            with infile, open_result_writer(output_file, output_format, frameshift_only,
+                                            labels=class_table(self.prerequesites[1]).labels,
+                                            sparse_threshold=sparse_threshold, resume=state) as writer:
+                entries = parse_sequence_lines(infile)
+                if start_line:
+                    entries = (entry for entry in entries if entry[0] >= start_line)
+                chunks = _chunked(entries, max(1, chunk_size))
+                for chunk, chunk_results in self._predict_chunks(chunks, top_n, workers, mode, visual):
+                    for (i, seq_name, _), result in zip(chunk, chunk_results):
+                        result['name'] = seq_name
+                        result['index'] = i + 1
+                        
+                        if 'error' in result:
+                            errors += 1
+                        else:
+                            processed += 1
+                        if not verbose:
+                            continue
+                        print(f"Processing {i+1}: {seq_name}", end=" ... ")
+                        if 'error' in result:
+                            print(f"ERROR: {result['error']}")
+                        elif mode != 'outcomes':
+                            print(f"OK (FS: {round(result['frameshift_ratio'], 4)})")
+                        else:
+                            print(f"OK (FS: {result['frameshift_ratio']}, {result['num_predictions']} predictions)")
+                    if not verbose:
+                        elapsed = time.perf_counter() - started
+                        print(f"Processed {processed + errors} sequences up to input line {chunk[-1][0] + 1} "
+                              f"({errors} errors, {(processed + errors) / max(elapsed, 1e-9):.0f} sequences/s)",
+                              flush=True)
+                    
+                    # Written per chunk so partial output is usable if the job is interrupted
+                    with profile_stage('write', len(chunk_results)):
+                        writer.write(chunk_results)
+                    if checkpoint is not None:
+                        checkpoint.save(next_line=chunk[-1][0] + 1, processed=processed, errors=errors,
+                                        **writer.state())
             
-            result = self.predict_single(sequence, top_n)
-            result['name'] = seq_name
-            result['index'] = i + 1
+            if checkpoint is not None:
+                checkpoint.save(next_line=None, processed=processed, errors=errors, complete=True,
+                                output_bytes=os.path.getsize(output_file), results=writer.count)
             
-            if 'error' in result:
-                print(f"ERROR: {result['error']}")
-                errors += 1
-            else:
-                print(f"OK (FS: {result['frameshift_ratio']}, {result['num_predictions']} predictions)")
-                processed += 1
+            print(f"\nResults written to: {output_file}")
+            print(f"Successfully processed: {processed}")
+            print(f"Errors: {errors}")
+            if self.cache is not None and workers <= 1:
+                stats = self.cache.stats()
+                print(f"Cache: {stats['hits']} hits ({stats['disk_hits']} from disk), {stats['misses']} misses")
+            if profiling_enabled():
+                print("\nProfile:")
+                print(PROFILER.summary(time.perf_counter() - started, processed + errors))
             
-            results.append(result)
+        except Exception as e:
+            print(f"Error processing batch file: {e}")
+    
+    def aggregate_batch_file(self, input_file: str, output_file: str, output_format: str = 'tsv',
+                             group_by: str = 'prefix', separator: str = '_', group_column: int = 3,
+                             best_k: int = 5, top_n: int = 5, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                             workers: int = 1) -> Optional[GroupAggregator]:
+        """
+        Predict a batch file and write one summary per group of targets instead of
+        one row per outcome.
         
-        # Write results
+        Args:
+            input_file: Path to input file with sequences
+            output_file: Path to output file
+            output_format: 'tsv', 'json' or 'npz' (npz holds the full mean distribution of each group)
+            group_by: Group by the whole 'name', its 'prefix' before separator, or a 'column'
+            separator: Separator ending the name prefix
+            group_column: Input column (1-based) holding the group with group_by='column'
+            best_k: Guides with the highest frameshift ratio kept per group
+            top_n: Outcomes of the mean distribution reported per group (tsv and json)
+            chunk_size: Number of sequences scored per batched model evaluation
+            workers: Number of worker processes scoring chunks in parallel
+            
+        Returns:
+            The aggregator holding the group summaries, or None on error
+        """
         try:
-            if output_format.lower() == 'json':
-                self._write_json_results(results, output_file)
-            elif output_format.lower() == 'csv':
-                self._write_csv_results(results, output_file)
-            else:  # Default to TSV
-                self._write_tsv_results(results, output_file)
+            infile = open_sequence_input(input_file)
+        except FileNotFoundError:
+            print(f"Error: Input file '{input_file}' not found.")
+            return None
+        
+        # the class table needs the model, so it is only built once the input is open
+        labels = class_table(self.prerequesites[1]).labels
+        groups = GroupAggregator(len(labels), best_k)
+        print("Processing sequences...")
+        started = time.perf_counter()
+        with infile:
+            entries = parse_sequence_lines(infile, group_column if group_by == 'column' else None)
+            chunks = _chunked(entries, max(1, chunk_size))
+            for chunk, chunk_results in self._predict_chunks(chunks, 0, workers, 'distribution'):
+                keys = [group_key(entry[1], group_by, separator, entry[3] if len(entry) > 3 else None)
+                        for entry in chunk]
+                ok = [k for k, r in enumerate(chunk_results) if 'error' not in r]
+                groups.add_errors([keys[k] for k, r in enumerate(chunk_results) if 'error' in r])
+                if ok:
+                    groups.add([keys[k] for k in ok], [chunk[k][1] for k in ok],
+                               [chunk_results[k]['sequence'] for k in ok],
+                               [chunk_results[k]['frameshift_ratio'] for k in ok],
+                               np.stack([chunk_results[k]['y_hat'] for k in ok]))
+        
+        with profile_stage('write', len(groups)):
+            self._write_groups(groups, labels, output_file, output_format, top_n)
+        print(f"Successfully processed: {int(groups.count.sum())}")
+        print(f"Errors: {int(groups.errors.sum())}")
+        print(f"Groups written to {output_file}: {len(groups)}")
+        if profiling_enabled():
+            print("\nProfile:")
+            print(PROFILER.summary(time.perf_counter() - started, int(groups.count.sum() + groups.errors.sum())))
+        return groups
+    
+    def _write_groups(self, groups: GroupAggregator, labels: List[str], output_file: str, output_format: str,
+                      top_n: int):
+        """Write group summaries as TSV, JSON or NPZ."""
+        summaries = groups.summaries()
+        if output_format == 'npz':
+            summaries = list(summaries)
+            columns = {'group': [g['group'] for g in summaries]}
+            for key in ('guides', 'errors', 'mean_frameshift', 'sd_frameshift', 'min_frameshift', 'max_frameshift'):
+                columns[key] = np.array([g[key] for g in summaries])
+            for rank in range(groups.best_k):
+                best = [g['best'][rank] if rank < len(g['best']) else ('', '', np.nan) for g in summaries]
+                columns[f'best_{rank + 1}_name'] = [b[0] for b in best]
+                columns[f'best_{rank + 1}_sequence'] = [b[1] for b in best]
+                columns[f'best_{rank + 1}_frameshift'] = np.array([b[2] for b in best])
+            y = np.array([g['mean_y_hat'] if g['mean_y_hat'] is not None else np.zeros(len(labels))
+                          for g in summaries]).reshape(len(summaries), len(labels))
+            with NpzPredictionWriter(output_file, labels) as writer:
+                writer.write(columns, y)
+        elif output_format == 'json':
+            with open(output_file, 'w') as f:
+                nan_to_none = lambda v: None if isinstance(v, float) and np.isnan(v) else v
+                json.dump([{**{k: nan_to_none(v) for k, v in g.items() if k != 'mean_y_hat'},
+                            'best': [{'name': n, 'sequence': s, 'frameshift_ratio': round(fs, 4)}
+                                     for n, s, fs in g['best']],
+                            'top_mean_outcomes': [] if g['mean_y_hat'] is None else
+                            [{'label': labels[i], 'frequency': round(float(g['mean_y_hat'][i]) * 100, 2)}
+                             for i in np.argsort(-g['mean_y_hat'], kind='stable')[:top_n]]}
+                           for g in summaries], f, indent=2)
+        else:
+            with open(output_file, 'w') as f:
+                f.write('\t'.join(GROUP_COLUMNS) + '\n')
+                for g in summaries:
+                    f.write('\t'.join(map(str, group_row(g, labels, top_n))) + '\n')
+    
+    def validate_precision(self, input_file: str, dtype: str = 'float32', tolerance: float = 1e-4,
+                           chunk_size: int = DEFAULT_CHUNK_SIZE) -> bool:
+        """
+        Compare predictions in a reduced precision dtype with float64 on a reference set.
+        
+        Args:
+            input_file: Reference sequences, in the batch input format
+            dtype: Reduced precision floating point type
+            tolerance: Largest acceptable absolute deviation of a probability or frameshift ratio
+            chunk_size: Sequences scored per batched model evaluation
             
-            print(f"\nResults written to: {output_file}")
-            print(f"Successfully processed: {processed}")
-            print(f"Errors: {errors}")
+        Returns:
+            True if the deviations are within tolerance
+        """
+        sequences = []
+        with open_sequence_input(input_file) as infile:
+            for _, _, sequence in parse_sequence_lines(infile):
+                is_valid, result = self.validate_sequence(sequence)
+                if is_valid:
+                    sequences.append(result)
+        if not sequences:
+            print("No valid sequences to compare.")
+            return False
+        
+        weights, _ = load_model()
+        report = compare_precision(sequences, weights, self.prerequesites, dtype, max(1, chunk_size))
+        print(f"Compared {report['sequences']} sequences, {report['dtype']} against float64:")
+        print(f"  Probabilities:     max |diff| {report['max_abs_probability']:.3e}, "
+              f"mean |diff| {report['mean_abs_probability']:.3e}")
+        print(f"  Frameshift ratios: max |diff| {report['max_abs_frameshift']:.3e}, "
+              f"mean |diff| {report['mean_abs_frameshift']:.3e}")
+        print(f"  Top outcome agreement: {report['top1_agreement']:.2%}")
+        
+        within = max(report['max_abs_probability'], report['max_abs_frameshift']) <= tolerance
+        print(f"{'PASS' if within else 'FAIL'}: tolerance {tolerance:g}")
+        return within
+    
+    def evaluate_file(self, observed_file: str, output_file: Optional[str] = None,
+                      chunk_size: int = DEFAULT_CHUNK_SIZE, min_count: float = 0) -> Optional[Dict]:
+        """
+        Compare predictions with observed outcome frequencies.
+        
+        Args:
+            observed_file: Tab-separated target, outcome and count rows grouped by target,
+                or a training set directory written by Lindel.Dataset
+            output_file: Optional TSV file with per-target metrics
+            chunk_size: Targets scored per batched model evaluation
+            min_count: Skip targets with fewer labelled reads
             
+        Returns:
+            The aggregate metrics, or None if the observations cannot be read
+        """
+        summary = EvaluationSummary()
+        rev_index = self.prerequesites[1]
+        try:
+            with open(output_file, 'w') if output_file else contextlib.nullcontext() as out:
+                if out:
+                    out.write('\t'.join(EVALUATION_COLUMNS) + '\n')
+                for chunk, metrics in evaluate(observed_file, self.weights, self.prerequesites,
+                                               max(1, chunk_size), min_count):
+                    summary.update(metrics, chunk['skipped'])
+                    if out:
+                        out.writelines('\t'.join(map(str, row)) + '\n'
+                                       for row in evaluation_rows(chunk, metrics, rev_index))
+        except FileNotFoundError:
+            print(f"Error: Observed outcome file '{observed_file}' not found.")
+            return None
+        except ValueError as e:
+            print(f"Error reading observed outcomes: {e}")
+            return None
+        
+        report = summary.result()
+        print(f"Evaluated {report['targets']} targets ({report['skipped']} skipped)")
+        print(f"  Mean squared error:        {report['mean_mse']:.4e}")
+        print(f"  Mean KL divergence:        {report['mean_kl']:.4f}")
+        print(f"  Frameshift ratio Pearson r: {report['frameshift_pearson']:.4f}")
+        print(f"  Top outcome agreement:     {report['top1_agreement']:.2%}")
+        if output_file:
+            print(f"Per-target metrics written to: {output_file}")
+        return report
+    
+    def save_distribution(self, sequence: str, output_file: str, output_format: str = 'npz',
+                          sparse_threshold: Optional[float] = None, frameshift: Optional[Dict] = None):
+        """
+        Write the full outcome distribution of one sequence in a columnar format.
+        
+        Args:
+            sequence: DNA sequence
+            output_file: Output file path
+            output_format: 'npz' or 'parquet'
+            sparse_threshold: Store only class probabilities at or above this value
+            frameshift: A predict_frameshift_batch result to write instead of the distribution
+        """
+        result = frameshift if frameshift is not None else self.predict_distribution_batch([sequence])[0]
+        with open_result_writer(output_file, output_format, frameshift is not None,
+                                labels=class_table(self.prerequesites[1]).labels,
+                                sparse_threshold=sparse_threshold) as writer:
+            writer.write([{**result, 'name': 'input_sequence', 'index': 1}])
+    
+    def scan_fasta_file(self, fasta_file: str, output_file: str, top_n: int = 3,
+                        chunk_size: int = DEFAULT_CHUNK_SIZE):
+        """
+        Find and score every SpCas9 (NGG) target site of a FASTA file on both strands.
+        
+        Args:
+            fasta_file: Path to FASTA file (optionally gzipped, '-' for stdin)
+            output_file: Path to output TSV file (one row per site)
+            top_n: Number of top outcomes reported per site
+            chunk_size: Number of sites scored per batched model evaluation
+        """
+        try:
+            sites = scan_fasta(fasta_file, self.weights, self.prerequesites, max(1, chunk_size), top_n)
+            count = write_scan_tsv(sites, output_file)
+        except FileNotFoundError:
+            print(f"Error: Input file '{fasta_file}' not found.")
+            return
         except Exception as e:
-            print(f"Error writing output file: {e}")
+            print(f"Error scanning FASTA file: {e}")
+            return
+        
+        print(f"\nResults written to: {output_file}")
+        print(f"Target sites scored: {count}")
+    
+    def scan_variants(self, sequence: str, output_file: Optional[str] = None, show: int = 10) -> Optional[Dict]:
+        """
+        Score every single-base substitution of a sequence.
+        
+        Args:
+            sequence: DNA sequence (validated, first 60bp used)
+            output_file: Optional TSV file with one row per variant
+            show: Number of variants with the largest frameshift change to print
+            
+        Returns:
+            The score_variants result, or None if the sequence is invalid
+        """
+        is_valid, result = self.validate_sequence(sequence)
+        if not is_valid:
+            print(f"Error: {result}")
+            return None
+        
+        scan = score_variants(result, self.weights, self.prerequesites)
+        rev_index = self.prerequesites[1]
+        print(f"\nSequence: {scan['sequence']}")
+        print(f"Frameshift ratio: {round(scan['frameshift'], 4)}")
+        print(f"Variants scored: {int(scan['valid'].sum())} ({int((~scan['valid']).sum())} break the PAM)")
+        
+        order = np.argsort(-np.abs(np.nan_to_num(scan['delta_frameshift'])), kind='stable')[:show]
+        rows = variant_rows(scan, rev_index)
+        print("\nLargest frameshift changes:")
+        print('\t'.join(VARIANT_COLUMNS))
+        for k in order:
+            print('\t'.join(map(str, rows[k])))
+        
+        if output_file:
+            count = write_variants_tsv(scan, rev_index, output_file)
+            print(f"\n{count} variants written to: {output_file}")
+        return scan
+    
+    def _predict_chunks(self, chunks, top_n: int, workers: int = 1, mode: str = 'outcomes',
+                        visual: bool = True):
+        """
+        Predict chunks of (index, name, sequence) entries, in this process or sharded
+        across a pool of worker processes. See _predict_chunk for the modes.
+        
+        Yields:
+            Tuples of (chunk, results) in input order
+        """
+        if workers <= 1:
+            for chunk in chunks:
+                yield self._predict_chunk(chunk, top_n, mode, visual)
+            return
+        
+        # Workers forked from this process inherit the already loaded (memory-mapped) model
+        cache_args = (self.cache.max_size, self.cache.path) if self.cache is not None else (0, None)
+        with multiprocessing.Pool(workers, initializer=_init_worker,
+                                  initargs=cache_args + (profiling_enabled(), self.dtype)) as pool:
+            for chunk, results, profile in pool.imap(_predict_chunk_worker,
+                                                     ((chunk, top_n, mode, visual) for chunk in chunks)):
+                if profile is not None:
+                    PROFILER.merge(profile)
+                yield chunk, results
+    
+    def _predict_chunk(self, chunk: List[Tuple], top_n: int, mode: str = 'outcomes',
+                       visual: bool = True) -> Tuple[List[Tuple], List[Dict]]:
+        """
+        Predict one chunk of (index, name, sequence) entries.
+        
+        Modes: 'outcomes' (top formatted outcomes, predict_batch), 'frameshift'
+        (predict_frameshift_batch) or 'distribution' (predict_distribution_batch).
+        """
+        sequences = [entry[2] for entry in chunk]
+        if mode == 'frameshift':
+            return chunk, self.predict_frameshift_batch(sequences)
+        if mode == 'distribution':
+            return chunk, self.predict_distribution_batch(sequences)
+        return chunk, self.predict_batch(sequences, top_n, visual)
     
     def _write_json_results(self, results: List[Dict], output_file: str):
         """Write results in JSON format."""
-        with open(output_file, 'w') as f:
-            json.dump(results, f, indent=2)
+        with JsonResultWriter(output_file) as writer:
+            writer.write(results)
     
     def _write_tsv_results(self, results: List[Dict], output_file: str):
         """Write results in TSV format."""
-        with open(output_file, 'w') as f:
-            # Header
-            f.write("Name\tSequence\tFrameshift_Ratio\tIndel_Type\tSize\tPosition\tFrequency\tDescription\tVisual\n")
-            
-            for result in results:
-                name = result.get('name', 'unknown')
-                sequence = result.get('sequence', 'N/A')
-                
-                if 'error' in result:
-                    f.write(f"{name}\t{sequence}\tERROR\t\t\t\t\t{result['error']}\t\n")
-                    continue
-                
-                fs_ratio = result.get('frameshift_ratio', 0)
-                
-                if not result.get('predictions'):
-                    f.write(f"{name}\t{sequence}\t{fs_ratio}\tNo predictions\t\t\t\t\t\n")
-                    continue
-                
-                for pred in result['predictions']:
-                    f.write(f"{name}\t{sequence}\t{fs_ratio}\t{pred['type']}\t"
-                           f"{pred['size']}\t{pred.get('position', '')}\t{pred['frequency']}\t"
-                           f"{pred['description']}\t{pred['visual']}\n")
+        with TsvResultWriter(output_file) as writer:
+            writer.write(results)
     
     def _write_csv_results(self, results: List[Dict], output_file: str):
         """Write results in CSV format."""
-        import csv
+        with CsvResultWriter(output_file) as writer:
+            writer.write(results)
+
+
+def open_sequence_input(input_file: str) -> io.TextIOBase:
+    """
+    Open a sequence input file for streaming, '-' meaning standard input.
+    Gzip-compressed input is detected from its magic number.
+    """
+    return open_input(input_file)
+
+
+def parse_sequence_lines(lines: Iterable[str], extra_column: Optional[int] = None) -> Iterator[Tuple]:
+    """
+    Parse input lines lazily into (line_index, name, sequence) entries.
+    
+    Each line holds a sequence and an optional tab-separated name; blank lines are
+    skipped and unnamed sequences are called seq_<line number>. With extra_column
+    (1-based), entries get a fourth item, the value of that column ('' if missing).
+    """
+    for i, line in enumerate(lines):
+        line = line.strip()
+        if not line:
+            continue
         
-        with open(output_file, 'w', newline='') as f:
-            writer = csv.writer(f)
-            
-            # Header
-            writer.writerow(["Name", "Sequence", "Frameshift_Ratio", "Indel_Type", "Size", "Position", "Frequency", "Description", "Visual"])
-            
-            for result in results:
-                name = result.get('name', 'unknown')
-                sequence = result.get('sequence', 'N/A')
-                
-                if 'error' in result:
-                    writer.writerow([name, sequence, "ERROR", "", "", "", "", result['error'], ""])
-                    continue
-                
-                fs_ratio = result.get('frameshift_ratio', 0)
-                
-                if not result.get('predictions'):
-                    writer.writerow([name, sequence, fs_ratio, "No predictions", "", "", "", "", ""])
-                    continue
-                
-                for pred in result['predictions']:
-                    writer.writerow([name, sequence, fs_ratio, pred['type'], pred['size'], 
-                                   pred.get('position', ''), pred['frequency'], pred['description'], pred['visual']])
+        # Parse line (sequence and optional name)
+        parts = line.split('\t')
+        sequence = parts[0].strip()
+        seq_name = parts[1].strip() if len(parts) > 1 else f"seq_{i+1}"
+        if extra_column is None:
+            yield i, seq_name, sequence
+        else:
+            yield i, seq_name, sequence, parts[extra_column - 1].strip() if len(parts) >= extra_column else ''
+
+
+def _chunked(iterable: Iterable, size: int) -> Iterator[List]:
+    """Split an iterable into lists of at most size items."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _open_output(output_file: str, newline: Optional[str] = None):
+    """Open an output file for text writing, gzip-compressed if it ends in .gz."""
+    if output_file.endswith('.gz'):
+        return gzip.open(output_file, 'wt', newline=newline)
+    return open(output_file, 'w', newline=newline)
+
+
+def _reopen_output(output_file: str, size: int, newline: Optional[str] = None):
+    """Open an existing output file for appending after truncating it to size bytes."""
+    with open(output_file, 'r+b') as f:
+        f.truncate(size)
+    return open(output_file, 'a', newline=newline)
+
+
+class BatchCheckpoint:
+    """
+    Sidecar file (<output>.ckpt) recording the progress of a resumable batch job:
+    the next input line to process, the size and result count of the output up to
+    there, and the counts of processed and failed sequences. It is replaced
+    atomically after each chunk, and records the job settings so a checkpoint is
+    never resumed with a different input or output configuration.
+    """
+    
+    def __init__(self, output_file: str, job: Dict):
+        self.output_file = output_file
+        self.path = output_file + CHECKPOINT_SUFFIX
+        self.job = job
+    
+    def load(self) -> Optional[Dict]:
+        """The saved progress, or None when there is no checkpoint to resume from."""
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path) as f:
+            state = json.load(f)
+        if state.get('job') != self.job:
+            raise ValueError(f"Checkpoint {self.path} was written for a different job; remove it to start over")
+        if not os.path.exists(self.output_file) or os.path.getsize(self.output_file) < state['output_bytes']:
+            raise ValueError(f"Output file {self.output_file} is missing or shorter than its checkpoint")
+        return state
+    
+    def save(self, **state):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'job': self.job, **state}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+
+def _input_fingerprint(input_file: str) -> Dict:
+    """Identify an input file by path, size and modification time ('-' for stdin)."""
+    if input_file == '-':
+        return {'input': '-'}
+    stat = os.stat(input_file)
+    return {'input': os.path.abspath(input_file), 'input_size': stat.st_size, 'input_mtime': stat.st_mtime}
+
+
+RESULT_COLUMNS = ["Name", "Sequence", "Frameshift_Ratio", "Indel_Type", "Size", "Position", "Frequency", "Description", "Visual"]
+FRAMESHIFT_COLUMNS = ["Name", "Sequence", "Frameshift_Ratio", "Deletion_Ratio", "Insertion_Ratio"]
+
+
+def _result_rows(result: Dict) -> Iterator[List]:
+    """Table rows (one per predicted outcome) of a single result, as in RESULT_COLUMNS."""
+    name = result.get('name', 'unknown')
+    sequence = result.get('sequence', 'N/A')
+    
+    if 'error' in result:
+        yield [name, sequence, "ERROR", "", "", "", "", result['error'], ""]
+        return
+    
+    fs_ratio = result.get('frameshift_ratio', 0)
+    
+    if not result.get('predictions'):
+        yield [name, sequence, fs_ratio, "No predictions", "", "", "", "", ""]
+        return
+    
+    for pred in result['predictions']:
+        yield [name, sequence, fs_ratio, pred['type'], pred['size'],
+               pred.get('position', ''), pred['frequency'], pred['description'], pred.get('visual', '')]
+
+
+def _frameshift_rows(result: Dict) -> Iterator[List]:
+    """Table row of a frameshift-only result, as in FRAMESHIFT_COLUMNS."""
+    name = result.get('name', 'unknown')
+    sequence = result.get('sequence', 'N/A')
+    
+    if 'error' in result:
+        yield [name, sequence, "ERROR", "", result['error']]
+        return
+    
+    yield [name, sequence, result['frameshift_ratio'], result['deletion_ratio'], result['insertion_ratio']]
+
+
+class ResultWriter:
+    """
+    Incremental writer of batch results: each call to write() appends a chunk of
+    result dictionaries and flushes it, so memory use does not grow with the input.
+    """
+    newline: Optional[str] = None
+    
+    resumable = True
+    
+    def __init__(self, output_file: str, frameshift_only: bool = False, resume: Optional[Dict] = None, **options):
+        if frameshift_only:
+            self.columns, self.rows = FRAMESHIFT_COLUMNS, _frameshift_rows
+        else:
+            self.columns, self.rows = RESULT_COLUMNS, _result_rows
+        if resume:
+            # Continue a checkpointed file, dropping anything written after the checkpoint
+            self.f = _reopen_output(output_file, resume['output_bytes'], self.newline)
+            self.count = resume['results']
+            self.resume_header()
+        else:
+            self.f = _open_output(output_file, self.newline)
+            self.count = 0
+            self.write_header()
+    
+    def write_header(self):
+        pass
+    
+    def resume_header(self):
+        pass
+    
+    def write(self, results: List[Dict]):
+        for result in results:
+            self.write_result(result)
+            self.count += 1
+        self.f.flush()
+    
+    def write_result(self, result: Dict):
+        raise NotImplementedError
+    
+    def state(self) -> Dict:
+        """Position to resume from after the last write(), made durable on disk."""
+        os.fsync(self.f.fileno())
+        return {'output_bytes': os.fstat(self.f.fileno()).st_size, 'results': self.count}
+    
+    def close(self):
+        self.f.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class TsvResultWriter(ResultWriter):
+    """Write results in TSV format, one row per predicted outcome."""
+    
+    def write_header(self):
+        self.f.write('\t'.join(self.columns) + '\n')
+    
+    def write_result(self, result: Dict):
+        for row in self.rows(result):
+            self.f.write('\t'.join(map(str, row)) + '\n')
+
+
+class CsvResultWriter(ResultWriter):
+    """Write results in CSV format, same structure as TSV."""
+    newline = ''
+    
+    def write_header(self):
+        self.writer = csv.writer(self.f)
+        self.writer.writerow(self.columns)
+    
+    def resume_header(self):
+        self.writer = csv.writer(self.f)
+    
+    def write_result(self, result: Dict):
+        self.writer.writerows(self.rows(result))
+
+
+class JsonResultWriter(ResultWriter):
+    """Write results as a single JSON array, streamed one element at a time."""
+    
+    def write_result(self, result: Dict):
+        self.f.write(',\n' if self.count else '[\n')
+        self.f.write(textwrap.indent(json.dumps(result, indent=2), '  '))
+    
+    def close(self):
+        self.f.write('\n]' if self.count else '[]')
+        super().close()
+
+
+class JsonLinesResultWriter(ResultWriter):
+    """Write results as JSON Lines, one result object per line."""
+    
+    def write_result(self, result: Dict):
+        self.f.write(json.dumps(result) + '\n')
+
+
+class ColumnarResultWriter(ResultWriter):
+    """
+    Write results column-wise through a Lindel.Columnar writer: per-sequence name,
+    sequence, error and ratio columns plus the (N x 557) class probability matrix
+    (rows of zeros for failed sequences) rather than one text row per outcome.
+    """
+    writer_class = None
+    resumable = False
+    
+    def __init__(self, output_file: str, frameshift_only: bool = False, labels: Optional[List[str]] = None,
+                 sparse_threshold: Optional[float] = None, **options):
+        self.frameshift_only = frameshift_only
+        self.writer = self.writer_class(output_file, labels, sparse_threshold)
+        self.n_class = len(labels) if labels is not None else None
+    
+    def write(self, results: List[Dict]):
+        ok = ['error' not in r for r in results]
+        columns = {
+            'index': np.array([r.get('index', 0) for r in results], dtype=np.int64),
+            'name': [r.get('name', 'unknown') for r in results],
+            'sequence': [r.get('sequence', '') for r in results],
+            'error': [r.get('error') for r in results],
+            'frameshift_ratio': np.array([r['frameshift_ratio'] if k else np.nan for r, k in zip(results, ok)]),
+        }
+        y_hat = None
+        if self.frameshift_only:
+            for key in ('deletion_ratio', 'insertion_ratio'):
+                columns[key] = np.array([r[key] if k else np.nan for r, k in zip(results, ok)])
+        else:
+            y_hat = np.zeros((len(results), self.n_class), dtype=np.float32)
+            for k, r in enumerate(results):
+                if ok[k]:
+                    y_hat[k] = r['y_hat']
+        self.writer.write(columns, y_hat)
+    
+    def close(self):
+        self.writer.close()
+
+
+class NpzResultWriter(ColumnarResultWriter):
+    """Write results as an uncompressed, memory-mappable NPZ file."""
+    writer_class = NpzPredictionWriter
+
+
+class ParquetResultWriter(ColumnarResultWriter):
+    """Write results as a Parquet file (requires pyarrow)."""
+    writer_class = ParquetPredictionWriter
+
+
+RESULT_WRITERS = {
+    'tsv': TsvResultWriter,
+    'csv': CsvResultWriter,
+    'json': JsonResultWriter,
+    'jsonl': JsonLinesResultWriter,
+    'npz': NpzResultWriter,
+    'parquet': ParquetResultWriter,
+}
+COLUMNAR_FORMATS = ('npz', 'parquet')
+
+
+def open_result_writer(output_file: str, output_format: str = 'tsv', frameshift_only: bool = False,
+                       **options) -> ResultWriter:
+    """
+    Open the incremental writer for an output format (default: TSV).
+    
+    Columnar formats take the class labels ('labels') and an optional 'sparse_threshold'.
+    """
+    return RESULT_WRITERS.get(output_format.lower(), TsvResultWriter)(output_file, frameshift_only, **options)
+
+
+_worker_predictor: Optional[LindelBatchPredictor] = None
+
+
+def _init_worker(cache_size: int = 0, cache_db: Optional[str] = None, profile: bool = False,
+                 dtype: str = 'float64'):
+    """Create the per-process predictor of a worker of the process pool."""
+    global _worker_predictor
+    enable_profiling(profile)
+    PROFILER.reset()
+    _worker_predictor = LindelBatchPredictor(verbose=False, cache_size=cache_size, cache_db=cache_db, dtype=dtype)
+
+
+def _predict_chunk_worker(task: Tuple[List[Tuple], int, str, bool]) -> Tuple[List[Tuple], List[Dict], Optional[Dict]]:
+    """
+    Predict one chunk of (index, name, sequence) entries in a worker process. Also returns
+    the stage profile of the chunk when profiling, to be merged in the parent process.
+    """
+    chunk, results = _worker_predictor._predict_chunk(*task)
+    if not profiling_enabled():
+        return chunk, results, None
+    profile = PROFILER.snapshot()
+    PROFILER.reset()
+    return chunk, results, profile
 
 
 def main():
@@ -342,30 +1130,125 @@ def main():
     input_group.add_argument('-s', '--sequence', type=str, 
                            help='Single sequence to predict (60bp)')
     input_group.add_argument('-f', '--file', type=str,
-                           help='Input file with sequences (one per line)')
+                           help="Input file with sequences (one per line, optionally gzipped, '-' for stdin)")
+    input_group.add_argument('--fasta', type=str,
+                           help='FASTA file to scan for every NGG target site on both strands')
+    input_group.add_argument('--evaluate', type=str, metavar='OBSERVED',
+                           help='Compare predictions with observed outcomes: tab-separated target, outcome '
+                                'and count rows, or a training set directory from python -m Lindel.Dataset')
     
     # Output options
     parser.add_argument('-o', '--output', type=str,
                        help='Output file (required for batch processing)')
-    parser.add_argument('--format', choices=['tsv', 'csv', 'json'], default='tsv',
+    parser.add_argument('--format', choices=list(RESULT_WRITERS), default='tsv',
                        help='Output format (default: tsv)')
     parser.add_argument('--top', type=int, default=20,
                        help='Number of top predictions to include (default: 20)')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                       help=f'Sequences scored per batched model evaluation (default: {DEFAULT_CHUNK_SIZE})')
+    parser.add_argument('--workers', type=int, default=1,
+                       help='Number of worker processes for batch processing (default: 1)')
+    parser.add_argument('--sparse-threshold', type=float, default=None,
+                       help='For npz/parquet output, store only class probabilities at or above this value')
+    parser.add_argument('--dtype', choices=['float64', 'float32'], default='float64',
+                       help='Floating point type of the model evaluation; float32 is faster (default: float64)')
+    parser.add_argument('--validate-precision', action='store_true',
+                       help='Report the deviation of float32 from float64 predictions on the sequences of -f')
+    parser.add_argument('--tolerance', type=float, default=1e-4,
+                       help='Maximum absolute deviation accepted by --validate-precision (default: 1e-4)')
+    parser.add_argument('--variants', action='store_true',
+                       help='With -s, score every single-base substitution of the sequence (saturation scan)')
+    parser.add_argument('--min-count', type=float, default=0,
+                       help='With --evaluate, skip targets with fewer observed reads (default: 0)')
+    parser.add_argument('--group-by', choices=GROUP_BY, default=None,
+                       help='With -f, write one summary per group of targets instead of per-outcome rows: group '
+                            'by the whole name, its prefix before --group-separator, or input column --group-column')
+    parser.add_argument('--group-separator', type=str, default='_',
+                       help="Separator ending the name prefix for --group-by prefix (default: '_')")
+    parser.add_argument('--group-column', type=int, default=3,
+                       help='Input column (1-based) holding the group for --group-by column (default: 3)')
+    parser.add_argument('--best', type=int, default=5,
+                       help='With --group-by, guides with the highest frameshift ratio reported per group (default: 5)')
+    parser.add_argument('--resume', action='store_true',
+                       help=f'Checkpoint progress to <output>{CHECKPOINT_SUFFIX} and continue an interrupted run '
+                            'from it, appending to the output')
+    parser.add_argument('--profile', action='store_true',
+                       help='Report time spent per prediction stage (also enabled by LINDEL_PROFILE=1)')
+    parser.add_argument('--verbose', action='store_true',
+                       help='Report every sequence of a batch run instead of one progress line per chunk')
+    parser.add_argument('--no-visual', action='store_true',
+                       help='Leave out the visual alignment of each predicted outcome')
+    parser.add_argument('--frameshift-only', action='store_true',
+                       help='Only predict frameshift, deletion and insertion ratios (fast guide ranking)')
+    parser.add_argument('--cache-size', type=int, default=0,
+                       help='Keep up to this many predictions in an in-memory cache (default: 0, disabled)')
+    parser.add_argument('--cache-db', type=str, default=None,
+                       help='SQLite file caching predictions across runs, keyed by sequence and model version')
     
     # Parse arguments
     args = parser.parse_args()
     
     # Validate arguments
-    if args.file and not args.output:
+    if args.validate_precision:
+        if not args.file:
+            parser.error("--validate-precision requires an input file (-f)")
+        predictor = LindelBatchPredictor(verbose=False)
+        sys.exit(0 if predictor.validate_precision(args.file, 'float32', args.tolerance, args.chunk_size) else 1)
+    
+    if args.evaluate:
+        predictor = LindelBatchPredictor(verbose=False, dtype=args.dtype)
+        report = predictor.evaluate_file(args.evaluate, args.output, args.chunk_size, args.min_count)
+        sys.exit(0 if report is not None else 1)
+    
+    if (args.file or args.fasta) and not args.output:
         parser.error("Output file (-o) is required for batch processing")
     
+    if args.group_by:
+        if not args.file:
+            parser.error("--group-by requires an input file (-f)")
+        if args.format not in ('tsv', 'json', 'npz'):
+            parser.error("--group-by writes tsv, json or npz output")
+        if args.best < 1 or args.group_column < 1:
+            parser.error("--best and --group-column must be at least 1")
+    
+    if args.profile:
+        enable_profiling()
+    
     # Initialize predictor
-    predictor = LindelBatchPredictor()
+    predictor = LindelBatchPredictor(cache_size=args.cache_size, cache_db=args.cache_db, dtype=args.dtype)
+    
+    if args.variants:
+        if not args.sequence:
+            parser.error("--variants requires a single sequence (-s)")
+        print(f"Scoring single-base variants of: {args.sequence}")
+        if predictor.scan_variants(args.sequence, args.output) is None:
+            sys.exit(1)
     
-    if args.sequence:
+    elif args.sequence and args.frameshift_only:
+        print(f"Predicting frameshift ratio for sequence: {args.sequence}")
+        result = predictor.predict_frameshift_batch([args.sequence])[0]
+        
+        if 'error' in result:
+            print(f"Error: {result['error']}")
+            sys.exit(1)
+        
+        print(f"\nSequence: {result['sequence']}")
+        print(f"Frameshift ratio: {result['frameshift_ratio']}")
+        print(f"Deletion ratio: {result['deletion_ratio']}")
+        print(f"Insertion ratio: {result['insertion_ratio']}")
+        
+        if args.output:
+            if args.format in COLUMNAR_FORMATS:
+                predictor.save_distribution(args.sequence, args.output, args.format, args.sparse_threshold, result)
+            else:
+                with open_result_writer(args.output, args.format, frameshift_only=True) as writer:
+                    writer.write([{**result, 'name': 'input_sequence', 'index': 1}])
+            print(f"\nResults saved to: {args.output}")
+    
+    elif args.sequence:
         # Single sequence prediction
         print(f"Predicting for sequence: {args.sequence}")
-        result = predictor.predict_single(args.sequence, args.top)
+        result = predictor.predict_single(args.sequence, args.top, not args.no_visual)
         
         if 'error' in result:
             print(f"Error: {result['error']}")
@@ -379,21 +1262,39 @@ def main():
         
         for i, pred in enumerate(result['predictions'][:10], 1):
             print(f"{i:2d}. {pred['description']} - {pred['frequency']:.2f}%")
-            print(f"     {pred['visual']}")
+            if 'visual' in pred:
+                print(f"     {pred['visual']}")
         
         # Optionally save to file
         if args.output:
             if args.format == 'json':
                 with open(args.output, 'w') as f:
                     json.dump(result, f, indent=2)
+            elif args.format in COLUMNAR_FORMATS:
+                predictor.save_distribution(args.sequence, args.output, args.format, args.sparse_threshold)
             else:
-                predictor._write_tsv_results([{**result, 'name': 'input_sequence', 'index': 1}], args.output)
+                with open_result_writer(args.output, args.format) as writer:
+                    writer.write([{**result, 'name': 'input_sequence', 'index': 1}])
             print(f"\nResults saved to: {args.output}")
     
+    elif args.fasta:
+        # Genome scanning
+        print(f"Scanning FASTA file: {args.fasta}")
+        predictor.scan_fasta_file(args.fasta, args.output, args.top, args.chunk_size)
+    
+    elif args.group_by:
+        print(f"Summarizing batch file by {args.group_by}: {args.file}")
+        if predictor.aggregate_batch_file(args.file, args.output, args.format, args.group_by, args.group_separator,
+                                          args.group_column, args.best, args.top, args.chunk_size,
+                                          args.workers) is None:
+            sys.exit(1)
+    
     else:
         # Batch processing
         print(f"Processing batch file: {args.file}")
-        predictor.process_batch_file(args.file, args.output, args.format, args.top)
+        predictor.process_batch_file(args.file, args.output, args.format, args.top, args.chunk_size, args.workers,
+                                     args.frameshift_only, not args.no_visual, args.sparse_threshold, args.resume,
+                                     args.verbose)
 
 
 if __name__ == "__main__":
@@ -14,7 +14,7 @@ setuptools.setup(
     url="https://github.com/shendurelab/Lindel/tree/master/scripts",
     packages=['Lindel'],
     package_dir={'Lidel': 'Lindel'},
-    package_data={'Lindel': ['data/*.pkl']},
+    package_data={'Lindel': ['data/*.pkl', '*.pkl', 'model_arrays/*']},
     install_requires=['numpy','scipy'],
     classifiers=[
         "Programming Language :: Python :: 3",